@@ -1 +1,4 @@
 from eehelper.eehelper import EEHelper
+from eehelper.qa import QALayout, QAMask
+from eehelper.pack import PackManifest
+from eehelper.runner import WorkQueue
@@ -1,7 +1,9 @@
 import ee
 import sys
-import math
 import warnings
+from eehelper import qa
+from eehelper import pack
+from eehelper import plan
 
 
 class EEHelper(object):
@@ -283,22 +285,27 @@ class EEHelper(object):
             )
 
     @staticmethod
-    def ls_sr_only_clear(img):
+    def mask_qa(img,
+                masks):
         """
-        Method to calcluate clear mask based on pixel_qa and radsat_qa bands
+        Method to mask an image using QA bit flag masks, see eehelper.qa
+        All masks are combined and applied with a single updateMask call
 
         :param img: ee.Image object
+        :param masks: List of eehelper.qa.QAMask objects
         :returns ee.Image object
         """
-        clearbit = 1
-        clearmask = math.pow(2, clearbit)
-        qa = img.select('PIXEL_QA')
-        qa_mask = qa.bitwiseAnd(clearmask)
+        return ee.Image(ee.Image(img).updateMask(qa.ee_combined_mask(img, masks)))
 
-        ra = img.select('RADSAT_QA')
-        ra_mask = ra.eq(0)
+    @staticmethod
+    def ls_sr_only_clear(img):
+        """
+        Method to calcluate clear mask based on pixel_qa and radsat_qa bands
 
-        return ee.Image(img.updateMask(qa_mask).updateMask(ra_mask))
+        :param img: ee.Image object
+        :returns ee.Image object
+        """
+        return EEHelper.mask_qa(img, [qa.LANDSAT_CLEAR, qa.LANDSAT_NOT_SATURATED])
 
     @staticmethod
     def add_elevation_bands(img,
@@ -471,6 +478,72 @@ class EEHelper(object):
         else:
             return out_img
 
+    @staticmethod
+    def plan_image_export(img,
+                          folder=None,
+                          scale=None,
+                          crs=None,
+                          region=None,
+                          file_prefix=None,
+                          max_pixels=plan.DEFAULT_MAX_PIXELS,
+                          max_bytes=plan.DEFAULT_MAX_BYTES,
+                          strategy='tile',
+                          img_prop=None):
+        """
+        Method to estimate the size of an image export and split it into tiles,
+        or pick a coarser pyramid level, before any task is started.
+        Use ExportPlan.summary() to inspect and ExportPlan.execute() to start the tasks.
+        Exports in a projected crs request the region bounds in that crs from the server.
+
+        :param img: ee.Image object to export
+        :param folder: folder on Google drive to download image to
+        :param scale: Scale in meters to use for export (default: None, uses image native scale)
+        :param crs: CRS string (default: None, uses image native crs string)
+        :param region: Region to clip the image and use for extent, ee.Geometry or ee.Feature
+                       if ee.FeatureCollection is specified, first feature is used as region
+                      (default: None, uses image footprint)
+        :param file_prefix: Output file name prefix (default: None, uses image id)
+        :param max_pixels: Maximum number of pixels in one task (default: 1e10)
+        :param max_bytes: Maximum number of bytes in one task (default: 8 GiB)
+        :param strategy: 'tile' to split the export into tiles (default),
+                         'coarsen' to use the first pyramid level (2x pixel size per level) within the limits
+        :param img_prop: Image metadata if already retrieved using getInfo() (default: None, retrieves it)
+        :returns: eehelper.plan.ExportPlan object
+        """
+        if img_prop is None:
+            img_prop = ee.Image(img).getInfo()
+        img_id = file_prefix if file_prefix is not None else img_prop['id'].replace('/', '_')
+
+        if region is None:
+            region_geom = None
+        else:
+            img = img.clip(region)
+            region_geom = plan.region_coordinates(region.getInfo())
+            if region_geom is None:
+                warnings.warn('Invalid geometry, using image footprint for export.')
+
+        export_crs = crs if crs is not None else img_prop['bands'][0]['crs']
+        footprint = img_prop.get('properties', {}).get('system:footprint')
+        region_bounds = None
+        if export_crs not in plan.GEOGRAPHIC_CRS and (region_geom is not None or footprint is not None):
+            region_coords = region_geom if region_geom is not None else footprint['coordinates']
+            bounds_geom = ee.Geometry.Polygon(plan.bounds_polygon(plan.coordinates_bounds(region_coords)),
+                                              None,
+                                              False).bounds(1, export_crs)
+            region_bounds = plan.coordinates_bounds(plan.region_coordinates(bounds_geom.getInfo()))
+
+        return plan.plan_export(img,
+                                img_prop,
+                                img_id,
+                                folder=folder,
+                                scale=scale,
+                                crs=crs,
+                                region=region_geom,
+                                region_bounds=region_bounds,
+                                max_pixels=max_pixels,
+                                max_bytes=max_bytes,
+                                strategy=strategy)
+
     @staticmethod
     def export_image_to_drive(img,
                               folder=None,
@@ -479,11 +552,18 @@ class EEHelper(object):
                               region=None,
                               verbose=False,
                               save_metadata=True,
-                              metadata_folder='.'):
+                              metadata_folder='.',
+                              file_prefix=None,
+                              max_pixels=plan.DEFAULT_MAX_PIXELS,
+                              max_bytes=plan.DEFAULT_MAX_BYTES,
+                              strategy='tile',
+                              workers=4):
 
         """
         Method to download an image to google drive from an ee.Image object.
-        Ideally, this image should be part of an ee.ImageCollection object
+        Ideally, this image should be part of an ee.ImageCollection object.
+        Exports larger than max_pixels or max_bytes are split into tiles
+        (or exported at a coarser pyramid level) as planned by plan_image_export
 
         :param img: ee.Image object to download
         :param folder: folder on Google drive to download image to
@@ -495,57 +575,144 @@ class EEHelper(object):
         :param verbose: If some steps should be displayed (default: False)
         :param save_metadata: If the associated metadata with the image should be stored on local disk
         :param metadata_folder: Location to store image metadata as text
+        :param file_prefix: Output file name prefix (default: None, uses image id)
+        :param max_pixels: Maximum number of pixels in one task (default: 1e10)
+        :param max_bytes: Maximum number of bytes in one task (default: 8 GiB)
+        :param strategy: 'tile' or 'coarsen', see plan_image_export (default: 'tile')
+        :param workers: Number of tile tasks to submit in parallel (default: 4)
+        :returns: eehelper.plan.ExportPlan object with started tasks
         """
 
         img_prop = ee.Image(img).getInfo()
-        img_id = img_prop['id'].replace('/', '_')
         metadata_str = EEHelper.expand_image_meta(img_prop)
 
-        if crs is None:
-            crs = img_prop['bands'][0]['crs']
-        crs_transform = img_prop['bands'][0]['crs_transform']
+        export_plan = EEHelper.plan_image_export(img,
+                                                 folder=folder,
+                                                 scale=scale,
+                                                 crs=crs,
+                                                 region=region,
+                                                 file_prefix=file_prefix,
+                                                 max_pixels=max_pixels,
+                                                 max_bytes=max_bytes,
+                                                 strategy=strategy,
+                                                 img_prop=img_prop)
 
-        if scale is None:
-            scale = crs_transform[0]
+        if verbose:
+            sys.stdout.write('Exporting: {}\n'.format(folder + '/' + export_plan.file_prefix))
+            sys.stdout.write(metadata_str)
 
+        export_plan.execute(workers=workers,
+                            verbose=verbose)
+
+        if save_metadata:
+            with open(metadata_folder + '/' + export_plan.file_prefix + '.txt', 'w') as metadata_file_ptr:
+                metadata_file_ptr.write(metadata_str)
+
+        return export_plan
+
+    @staticmethod
+    def export_packed_to_drive(packed_img,
+                               manifest,
+                               file_prefix,
+                               folder=None,
+                               scale=None,
+                               crs=None,
+                               region=None,
+                               verbose=False,
+                               save_metadata=True,
+                               metadata_folder='.'):
+        """
+        Method to download a packed image (see eehelper.pack) to google drive as a single task.
+        The band name manifest is written to metadata_folder as <file_prefix>_manifest.json,
+        use PackManifest.load(...).unpack_image(array) to split the downloaded image per image.
+        A region is required, images stacked with toBands() (and composites) have no footprint.
+
+        :param packed_img: Packed ee.Image object
+        :param manifest: PackManifest object of the packed image
+        :param file_prefix: Output file name prefix
+        :param folder: folder on Google drive to download image to
+        :param scale: Scale in meters to use for export (default: None, uses image native scale)
+        :param crs: CRS string (default: None, uses image native crs string)
+        :param region: Region to clip the image and use for extent, ee.Geometry or ee.Feature (required)
+        :param verbose: If some steps should be displayed (default: False)
+        :param save_metadata: If the associated metadata with the image should be stored on local disk
+        :param metadata_folder: Location to store image metadata and manifest
+        :returns: eehelper.plan.ExportPlan object with started tasks
+        """
         if region is None:
-            region_geom = img_prop['properties']['system:footprint']['coordinates']
-        else:
-            img = img.clip(region)
-            region_dict = region.getInfo()
-            if region_dict['type'] == 'FeatureCollection':
-                region_geom = region_dict['features'][0]['geometry']['coordinates']
-            elif region_dict['type'] == 'Feature':
-                region_geom = region_dict['geometry']['coordinates']
-            elif region_dict['type'] == 'Geometry':
-                region_geom = region_dict['coordinates']
-            else:
-                warnings.warn('Invalid geometry, using image footprint for export.')
-                region_geom = img_prop['properties']['system:footprint']['coordinates']
+            raise RuntimeError('A region is required to export a packed image, it has no footprint')
+
+        export_plan = EEHelper.export_image_to_drive(packed_img,
+                                                     folder=folder,
+                                                     scale=scale,
+                                                     crs=crs,
+                                                     region=region,
+                                                     verbose=verbose,
+                                                     save_metadata=save_metadata,
+                                                     metadata_folder=metadata_folder,
+                                                     file_prefix=file_prefix)
+
+        manifest.save(metadata_folder + '/' + file_prefix + '_manifest.json')
+        return export_plan
+
+    @staticmethod
+    def export_packed_table_to_drive(packed_img,
+                                     manifest,
+                                     features,
+                                     file_prefix,
+                                     folder=None,
+                                     scale=None,
+                                     crs=None,
+                                     tile_scale=1,
+                                     nodata=-9999,
+                                     verbose=False,
+                                     metadata_folder='.'):
+        """
+        Method to sample a packed image (see eehelper.pack) at features and download
+        the sampled values to google drive as a single CSV table task.
+        Masked pixels (and pixels outside an image footprint) are written as nodata,
+        since sampling drops a location where any band of the stack is masked.
+        The band name manifest, including nodata, is written to metadata_folder as
+        <file_prefix>_manifest.json, use PackManifest.load(...).unpack_table(rows)
+        to split the downloaded rows per image.
+
+        :param packed_img: Packed ee.Image object
+        :param manifest: PackManifest object of the packed image
+        :param features: ee.FeatureCollection object of sample locations
+        :param file_prefix: Output file name prefix
+        :param folder: folder on Google drive to download table to
+        :param scale: Scale in meters to sample at (default: None, uses image native scale)
+        :param crs: CRS string to sample in (default: None, uses image native crs string)
+        :param tile_scale: Tile scale for sampling, increase if the sampling runs out of memory
+        :param nodata: Value written for masked pixels (default: -9999)
+        :param verbose: If some steps should be displayed (default: False)
+        :param metadata_folder: Location to store the manifest
+        :returns: ee.batch.Task object
+        """
+        manifest = pack.PackManifest(manifest.images, manifest.bands, nodata=nodata)
+
+        # sameFootprint=False also fills pixels outside each image footprint
+        samples = ee.Image(packed_img)\
+            .unmask(nodata, False)\
+            .sampleRegions(collection=features,
+                           scale=scale,
+                           projection=crs,
+                           tileScale=tile_scale,
+                           geometries=False)
 
         if verbose:
-            sys.stdout.write('Exporting: {}\n'.format(folder + '/' + img_id))
-            sys.stdout.write(metadata_str)
+            sys.stdout.write('Exporting: {} ({})\n'.format(folder + '/' + file_prefix, str(manifest)))
 
-        task = ee.batch.Export.image.toDrive(
-            image=img,
-            fileNamePrefix=img_id,
+        task = ee.batch.Export.table.toDrive(
+            collection=samples,
+            description='Export_{}'.format(file_prefix),
             folder=folder,
-            description='Export_{}'.format(img_id),
-            scale=scale,
-            crsTransform=crs_transform,
-            crs=crs,
-            region=region_geom,
-            maxPixels=1e13,
-            skipEmptyTiles=True)
-
-        res = task.start()
-        if verbose:
-            sys.stdout.write(task)
+            fileNamePrefix=file_prefix,
+            fileFormat='CSV')
+        task.start()
 
-        if save_metadata:
-            with open(metadata_folder + '/' + img_id + '.txt', 'w') as metadata_file_ptr:
-                metadata_file_ptr.write(metadata_str)
+        manifest.save(metadata_folder + '/' + file_prefix + '_manifest.json')
+        return task
 
     @staticmethod
     def export_coll_to_drive(collection,
@@ -555,25 +722,72 @@ class EEHelper(object):
                              crs=None,
                              verbose=False,
                              save_metadata=True,
-                             metadata_folder='.'):
+                             metadata_folder='.',
+                             packed=False,
+                             band_names=None,
+                             images_per_task=None,
+                             file_prefix='packed'):
 
         """
         Method to download an Image Collection to google drive from an ee.ImageCollection object.
+        By default one task is started per image. In packed mode, the images are stacked
+        into one multi-band image per task (see export_packed_to_drive).
 
         :param collection: ee.ImageCollection object to download
         :param folder: folder on Google drive to download image to
         :param crs: CRS string (default: None, uses image native crs string)
         :param region: Region to clip the image and use for extent, ee.Geometry or ee.Feature
                        if ee.FeatureCollection is specified, first feature is used as region
-                      (default: None, uses image footprint)
+                      (default: None, uses image footprint; required in packed mode)
         :param scale: Scale in meters to use for export (default: None, uses image native scale)
         :param verbose: If some steps should be displayed (default: False)
         :param save_metadata: If the associated metadata with the image should be stored on local disk
         :param metadata_folder: Location to store image metadata as text
+        :param packed: If the collection should be exported as packed images (default: False)
+        :param band_names: List of bands to export in packed mode (default: None, all bands of first image)
+        :param images_per_task: Number of images in each packed task (default: None, all images in one task)
+        :param file_prefix: Output file name prefix in packed mode, tasks are numbered if more than one
         """
 
+        if packed and region is None:
+            raise RuntimeError('A region is required to export a packed image, it has no footprint')
+
         collection = collection.filterBounds(region)
 
+        if packed:
+            packed_img, manifest = pack.pack_collection(collection, band_names)
+            coll_size = len(manifest.images)
+            if images_per_task is None or images_per_task >= coll_size:
+                images_per_task = max(coll_size, 1)
+            n_tasks = -(-coll_size // images_per_task)
+            sys.stdout.write("Exporting {} images from this collection in {} task(s).\n".format(coll_size,
+                                                                                               n_tasks))
+            if n_tasks > 1:
+                coll_list = collection.toList(coll_size)
+
+            for task_indx in range(n_tasks):
+                start = task_indx * images_per_task
+                end = start + images_per_task
+                task_prefix = file_prefix
+                task_manifest = manifest
+                if n_tasks > 1:
+                    task_prefix = '{}_{:04d}'.format(file_prefix, task_indx)
+                    task_manifest = manifest.subset(start, end)
+                    packed_img = pack.stack_collection(ee.ImageCollection(coll_list.slice(start, end)),
+                                                       task_manifest)
+
+                EEHelper.export_packed_to_drive(packed_img,
+                                                task_manifest,
+                                                file_prefix=task_prefix,
+                                                folder=folder,
+                                                scale=scale,
+                                                crs=crs,
+                                                region=region,
+                                                verbose=verbose,
+                                                save_metadata=save_metadata,
+                                                metadata_folder=metadata_folder)
+            return
+
         # get size info
         coll_size = collection.size().getInfo()
         sys.stdout.write("Exporting {} images from this collection.\n".format(coll_size))
@@ -0,0 +1,189 @@
+import ee
+import json
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class PackManifest(object):
+    """
+    Band name manifest of a packed image: every image in a collection (or every
+    window of a composite grid) stacked as consecutive bands of a single image
+    """
+    def __init__(self,
+                 images,
+                 bands,
+                 nodata=None):
+        """
+        :param images: List of image ids or labels, in band order
+        :param bands: List of band names of each image
+        :param nodata: Value used for masked pixels in the packed export (default: None)
+        """
+        self.images = list(images)
+        self.bands = list(bands)
+        self.nodata = nodata
+
+    def __repr__(self):
+        return '<PackManifest: {} images x {} bands>'.format(len(self.images), len(self.bands))
+
+    def __len__(self):
+        return len(self.images) * len(self.bands)
+
+    @property
+    def band_names(self):
+        """
+        Names of the bands in the packed image, image by image
+        """
+        return list('i{:04d}_{}'.format(img_indx, band)
+                    for img_indx in range(len(self.images)) for band in self.bands)
+
+    def subset(self,
+               start,
+               end):
+        """
+        Manifest for a consecutive subset of the images
+        :param start: index of first image
+        :param end: index after the last image
+        :returns: PackManifest object
+        """
+        return PackManifest(self.images[start:end], self.bands, self.nodata)
+
+    def to_dict(self):
+        return OrderedDict([('images', self.images),
+                            ('bands', self.bands),
+                            ('band_names', self.band_names),
+                            ('nodata', self.nodata)])
+
+    @staticmethod
+    def from_dict(manifest_dict):
+        return PackManifest(manifest_dict['images'], manifest_dict['bands'], manifest_dict.get('nodata'))
+
+    def save(self,
+             filename):
+        """
+        Write manifest to a JSON file
+        :param filename: Output file name
+        """
+        with open(filename, 'w') as manifest_ptr:
+            json.dump(self.to_dict(), manifest_ptr, indent=2)
+
+    @staticmethod
+    def load(filename):
+        """
+        Read manifest from a JSON file
+        :param filename: Input file name
+        :returns: PackManifest object
+        """
+        with open(filename) as manifest_ptr:
+            return PackManifest.from_dict(json.load(manifest_ptr))
+
+    def unpack_image(self,
+                     array,
+                     band_axis=0):
+        """
+        Split a downloaded packed image into per-image arrays.
+        Returned arrays are views into the input array.
+
+        :param array: numpy array of the packed image
+        :param band_axis: Axis of array along which bands are stacked (default: 0)
+        :returns: OrderedDict of image id: array with bands on the first axis
+        """
+        if np is None:
+            raise RuntimeError('numpy is required to unpack images')
+
+        array = np.moveaxis(np.asarray(array), band_axis, 0)
+        if array.shape[0] != len(self):
+            raise RuntimeError('Packed image has {} bands, manifest has {}'.format(array.shape[0], len(self)))
+
+        stack = array.reshape((len(self.images), len(self.bands)) + array.shape[1:])
+        return OrderedDict((img_id, stack[img_indx]) for img_indx, img_id in enumerate(self.images))
+
+    def unpack_table(self,
+                     rows):
+        """
+        Split rows of a packed sample table into per-image rows
+        :param rows: Iterable of dictionaries, one per sample (e.g. from csv.DictReader)
+        :returns: OrderedDict of image id: list of dictionaries of band name: value,
+                  columns that are not packed bands are copied to every image row,
+                  missing and nodata values are None
+        """
+        band_names = self.band_names
+        packed_columns = set(band_names)
+        out_rows = OrderedDict((img_id, []) for img_id in self.images)
+        n_bands = len(self.bands)
+
+        for row in rows:
+            extra = dict((k, v) for k, v in row.items() if k not in packed_columns)
+            for img_indx, img_id in enumerate(self.images):
+                img_row = dict(extra)
+                for band_indx, band in enumerate(self.bands):
+                    img_row[band] = self._value(row.get(band_names[img_indx * n_bands + band_indx]))
+                out_rows[img_id].append(img_row)
+        return out_rows
+
+    def _value(self,
+               value):
+        if value is None or value == '':
+            return None
+        if self.nodata is not None:
+            try:
+                if float(value) == self.nodata:
+                    return None
+            except (TypeError, ValueError):
+                pass
+        return value
+
+
+def stack_collection(collection,
+                     manifest):
+    """
+    Stack the images of an ee.ImageCollection object as bands of a single image
+    :param collection: ee.ImageCollection object, in manifest order
+    :param manifest: PackManifest object
+    :returns: ee.Image object
+    """
+    return ee.ImageCollection(collection).select(manifest.bands).toBands().rename(manifest.band_names)
+
+
+def pack_collection(collection,
+                    band_names=None):
+    """
+    Pack an ee.ImageCollection object into a single multi-band image.
+    Image ids and band names are fetched in one server request.
+
+    :param collection: ee.ImageCollection object
+    :param band_names: List of band names to keep from each image (default: None, all bands of first image)
+    :returns: tuple of (ee.Image object, PackManifest object)
+    """
+    collection = ee.ImageCollection(collection)
+    if band_names is None:
+        band_names = ee.Image(collection.first()).bandNames()
+
+    info = ee.Dictionary({'images': collection.aggregate_array('system:index'),
+                          'bands': band_names}).getInfo()
+
+    manifest = PackManifest(info['images'], info['bands'])
+    return stack_collection(collection, manifest), manifest
+
+
+def pack_images(images,
+                labels,
+                band_names):
+    """
+    Pack a list of ee.Image objects (e.g. a window grid of composites) into a single
+    multi-band image, without any server request
+
+    :param images: List of ee.Image objects, all with bands band_names
+    :param labels: List of labels, one for each image (e.g. 'y2000_jan')
+    :param band_names: List of band names of each image
+    :returns: tuple of (ee.Image object, PackManifest object)
+    """
+    images = list(images)
+    if len(images) != len(labels):
+        raise RuntimeError('Number of labels ({}) does not match number of images ({})'.format(len(labels),
+                                                                                               len(images)))
+    manifest = PackManifest(labels, band_names)
+    return stack_collection(ee.ImageCollection(images), manifest), manifest
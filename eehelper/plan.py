@@ -0,0 +1,440 @@
+import ee
+import sys
+import math
+import warnings
+from multiprocessing.pool import ThreadPool
+
+
+METERS_PER_DEGREE = 111319.49
+GEOGRAPHIC_CRS = ('EPSG:4326', 'EPSG:4269', 'EPSG:4267', 'EPSG:4258')
+
+# size limits for a single export task
+DEFAULT_MAX_PIXELS = 1e10
+DEFAULT_MAX_BYTES = 2 ** 33
+
+# Export.image maxPixels of every task, tiles are kept within the planned limits
+MAX_TOTAL_PIXELS = 1e13
+
+
+def band_bytes(data_type):
+    """
+    Number of bytes per pixel of a band
+    :param data_type: 'data_type' dictionary of band metadata retrieved using getInfo()
+    :returns: int
+    """
+    precision = data_type.get('precision', 'double')
+    if precision == 'float':
+        return 4
+    elif precision == 'double':
+        return 8
+
+    min_val = data_type.get('min', -2 ** 31)
+    max_val = data_type.get('max', 2 ** 31 - 1)
+    for n_bytes in (1, 2, 4):
+        if min_val >= 0 and max_val < 2 ** (8 * n_bytes):
+            return n_bytes
+        if min_val >= -2 ** (8 * n_bytes - 1) and max_val < 2 ** (8 * n_bytes - 1):
+            return n_bytes
+    return 8
+
+
+def region_coordinates(region_dict):
+    """
+    Get coordinates of a region from its metadata
+    :param region_dict: ee.Geometry, ee.Feature or ee.FeatureCollection metadata retrieved using getInfo()
+                        if ee.FeatureCollection is specified, first feature is used
+    :returns: GeoJSON coordinates, or None if the region is not valid
+    """
+    if region_dict['type'] == 'FeatureCollection':
+        return region_dict['features'][0]['geometry']['coordinates']
+    elif region_dict['type'] == 'Feature':
+        return region_dict['geometry']['coordinates']
+    elif 'coordinates' in region_dict:
+        return region_dict['coordinates']
+    else:
+        return None
+
+
+def coordinates_bounds(coords):
+    """
+    Bounding box of (nested lists of) GeoJSON coordinates
+    :param coords: GeoJSON coordinates
+    :returns: tuple of (xmin, ymin, xmax, ymax)
+    """
+    if not isinstance(coords[0], (list, tuple)):
+        # Point
+        coords = [coords]
+    while isinstance(coords[0][0], (list, tuple)):
+        coords = [point for part in coords for point in part]
+    x_coords = list(point[0] for point in coords)
+    y_coords = list(point[1] for point in coords)
+    return min(x_coords), min(y_coords), max(x_coords), max(y_coords)
+
+
+def bounds_polygon(bounds):
+    """
+    Polygon coordinates of a bounding box
+    :param bounds: tuple of (xmin, ymin, xmax, ymax)
+    :returns: GeoJSON polygon coordinates
+    """
+    xmin, ymin, xmax, ymax = bounds
+    return [[[xmin, ymax], [xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]]]
+
+
+def pixel_window(bounds,
+                 transform):
+    """
+    Window of the pixel grid of an affine transform covering a bounding box
+    :param bounds: tuple of (xmin, ymin, xmax, ymax) in crs units
+    :param transform: Affine transform [x size, 0, x origin, 0, -y size, y origin] of a north-up grid
+    :returns: tuple of (first column, first row, number of columns, number of rows)
+    """
+    # box edges on a pixel edge (up to float precision) do not add a pixel
+    col_start = int(math.floor((bounds[0] - transform[2]) / transform[0] + 1e-6))
+    col_end = int(math.ceil((bounds[2] - transform[2]) / transform[0] - 1e-6))
+    row_start = int(math.floor((bounds[3] - transform[5]) / transform[4] + 1e-6))
+    row_end = int(math.ceil((bounds[1] - transform[5]) / transform[4] - 1e-6))
+    return col_start, row_start, max(col_end - col_start, 1), max(row_end - row_start, 1)
+
+
+class ExportTile(object):
+    """
+    One export task of an ExportPlan
+    """
+    def __init__(self,
+                 file_prefix,
+                 bounds,
+                 rows,
+                 cols,
+                 bytes_per_pixel,
+                 crs_transform=None):
+        """
+        :param file_prefix: Output file name prefix
+        :param bounds: tuple of (xmin, ymin, xmax, ymax) in crs units, on pixel edges
+        :param rows: Number of pixel rows
+        :param cols: Number of pixel columns
+        :param bytes_per_pixel: Number of bytes per pixel, all bands
+        :param crs_transform: Affine transform with the tile origin, for exports on the native grid (default: None)
+        """
+        self.file_prefix = file_prefix
+        self.bounds = bounds
+        self.rows = rows
+        self.cols = cols
+        self.bytes_per_pixel = bytes_per_pixel
+        self.crs_transform = crs_transform
+        self.task = None
+
+    def __repr__(self):
+        return '<ExportTile {}: {} x {} pixels, {:.1f} MB>'.format(self.file_prefix, self.cols, self.rows,
+                                                                   self.bytes / 1e6)
+
+    @property
+    def pixels(self):
+        return self.rows * self.cols
+
+    @property
+    def bytes(self):
+        return self.pixels * self.bytes_per_pixel
+
+    @property
+    def region(self):
+        return bounds_polygon(self.bounds)
+
+
+class ExportPlan(object):
+    """
+    Size estimate and tiling of an image export, computed before any task is started.
+    Inspect the plan (pixels, bytes, tiles, level) and start its tasks using execute()
+    """
+    def __init__(self,
+                 img,
+                 file_prefix,
+                 folder,
+                 crs,
+                 crs_transform,
+                 scale,
+                 region,
+                 bounds,
+                 rows,
+                 cols,
+                 bytes_per_pixel,
+                 level=0):
+        """
+        :param img: ee.Image object to export
+        :param file_prefix: Output file name prefix
+        :param folder: folder on Google drive to export to
+        :param crs: CRS string
+        :param crs_transform: Affine transform of the export, None to export at scale
+        :param scale: Scale in meters of the export, None to export on crs_transform
+        :param region: GeoJSON coordinates of the full export region
+        :param bounds: tuple of (xmin, ymin, xmax, ymax) of region in crs units, snapped to pixel edges
+        :param rows: Number of pixel rows in the full export
+        :param cols: Number of pixel columns in the full export
+        :param bytes_per_pixel: Number of bytes per pixel, all bands
+        :param level: Pyramid level of the export, each level doubles the pixel size (default: 0, native)
+        """
+        self.img = img
+        self.file_prefix = file_prefix
+        self.folder = folder
+        self.crs = crs
+        self.crs_transform = crs_transform
+        self.scale = scale
+        self.region = region
+        self.bounds = bounds
+        self.rows = rows
+        self.cols = cols
+        self.bytes_per_pixel = bytes_per_pixel
+        self.level = level
+        self.tiles = []
+
+    def __repr__(self):
+        return '<ExportPlan {}: {} x {} pixels, {:.1f} MB, {} tile(s), pyramid level {}>'\
+            .format(self.file_prefix, self.cols, self.rows, self.bytes / 1e6, len(self.tiles), self.level)
+
+    @property
+    def pixels(self):
+        return self.rows * self.cols
+
+    @property
+    def bytes(self):
+        return self.pixels * self.bytes_per_pixel
+
+    @property
+    def tasks(self):
+        return list(tile.task for tile in self.tiles if tile.task is not None)
+
+    def summary(self):
+        """
+        Describe the plan and its tiles
+        :returns: String
+        """
+        out_str = '{}\n'.format(repr(self))
+        for tile in self.tiles:
+            out_str += '  {}\n'.format(repr(tile))
+        return out_str
+
+    @property
+    def pixel_size(self):
+        """
+        Pixel width and height in crs units
+        """
+        if self.crs_transform is not None:
+            return abs(self.crs_transform[0]), abs(self.crs_transform[4])
+        return ((self.bounds[2] - self.bounds[0]) / float(self.cols),
+                (self.bounds[3] - self.bounds[1]) / float(self.rows))
+
+    def split(self,
+              max_pixels=DEFAULT_MAX_PIXELS,
+              max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Split the export into a grid of tiles at whole pixel offsets, each tile within max_pixels and max_bytes.
+        On the native grid every tile gets its own crs transform, shifted to the tile origin
+        :param max_pixels: Maximum number of pixels in one tile (default: 1e10)
+        :param max_bytes: Maximum number of bytes in one tile (default: 8 GiB)
+        :returns: ExportPlan object (self)
+        """
+        limit = max(int(min(max_pixels, max_bytes // self.bytes_per_pixel)), 1)
+
+        if self.pixels <= limit:
+            tile_cols, tile_rows = self.cols, self.rows
+        else:
+            # square tiles, or full height strips if the image is shorter than a tile
+            tile_cols = min(max(int(math.sqrt(limit)), 1), self.cols)
+            tile_rows = min(limit // tile_cols, self.rows)
+            tile_cols = min(limit // tile_rows, self.cols)
+
+        n_x = int(math.ceil(self.cols / float(tile_cols)))
+        n_y = int(math.ceil(self.rows / float(tile_rows)))
+
+        # same number of tiles, evenly sized (never larger than above)
+        tile_cols = int(math.ceil(self.cols / float(n_x)))
+        tile_rows = int(math.ceil(self.rows / float(n_y)))
+        x_size, y_size = self.pixel_size
+
+        self.tiles = []
+        for row_indx in range(n_y):
+            for col_indx in range(n_x):
+                col_start, row_start = col_indx * tile_cols, row_indx * tile_rows
+                cols = min(tile_cols, self.cols - col_start)
+                rows = min(tile_rows, self.rows - row_start)
+                if cols <= 0 or rows <= 0:
+                    continue
+                ymax = self.bounds[3] - row_start * y_size
+                xmin = self.bounds[0] + col_start * x_size
+                file_prefix = self.file_prefix if n_x * n_y == 1 else \
+                    '{}_t{:03d}_{:03d}'.format(self.file_prefix, row_indx, col_indx)
+                tile_transform = None
+                if self.crs_transform is not None:
+                    tile_transform = [self.crs_transform[0], self.crs_transform[1], xmin,
+                                      self.crs_transform[3], self.crs_transform[4], ymax]
+                self.tiles.append(ExportTile(file_prefix,
+                                             (xmin, ymax - rows * y_size, xmin + cols * x_size, ymax),
+                                             rows,
+                                             cols,
+                                             self.bytes_per_pixel,
+                                             tile_transform))
+        return self
+
+    def _start_tile(self, tile):
+        # the pixel grid is given either by the affine transform or by the scale, never both
+        if tile.crs_transform is not None:
+            # native grid: the tile is exactly its shifted transform and dimensions
+            grid = {'crsTransform': tile.crs_transform,
+                    'dimensions': '{}x{}'.format(tile.cols, tile.rows)}
+        elif len(self.tiles) == 1:
+            grid = {'scale': self.scale,
+                    'region': self.region}
+        else:
+            # scale grid: origin at 0, 0 of crs, tile edges are on pixel edges
+            grid = {'scale': self.scale,
+                    'region': ee.Geometry.Polygon(tile.region, self.crs, False)}
+
+        tile.task = ee.batch.Export.image.toDrive(
+            image=self.img,
+            fileNamePrefix=tile.file_prefix,
+            folder=self.folder,
+            description='Export_{}'.format(tile.file_prefix),
+            crs=self.crs,
+            maxPixels=int(MAX_TOTAL_PIXELS),
+            skipEmptyTiles=True,
+            **grid)
+        tile.task.start()
+        return tile.task
+
+    def execute(self,
+                workers=4,
+                verbose=False):
+        """
+        Start the export tasks of all tiles
+        :param workers: Number of tasks to submit in parallel (default: 4)
+        :param verbose: If some steps should be displayed (default: False)
+        :returns: List of ee.batch.Task objects
+        """
+        if verbose:
+            sys.stdout.write(self.summary())
+
+        if workers > 1 and len(self.tiles) > 1:
+            pool = ThreadPool(min(workers, len(self.tiles)))
+            try:
+                tasks = pool.map(self._start_tile, self.tiles)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            tasks = list(self._start_tile(tile) for tile in self.tiles)
+
+        return tasks
+
+
+def plan_export(img,
+                img_prop,
+                file_prefix,
+                folder=None,
+                scale=None,
+                crs=None,
+                region=None,
+                region_bounds=None,
+                max_pixels=DEFAULT_MAX_PIXELS,
+                max_bytes=DEFAULT_MAX_BYTES,
+                strategy='tile',
+                max_level=8):
+    """
+    Plan an image export from already retrieved image metadata, without any server request.
+    The pixel grid is the first band crs transform, unless scale or a different crs is specified,
+    then it is the grid of the scale with origin at 0, 0 of crs (as used by Export.image).
+    Pixel counts are those of the grid window covering the bounding box of the region.
+
+    :param img: ee.Image object to export
+    :param img_prop: Image metadata retrieved using getInfo()
+    :param file_prefix: Output file name prefix
+    :param folder: folder on Google drive to export to
+    :param scale: Scale in meters (default: None, uses first band crs transform or its pixel size)
+    :param crs: CRS string (default: None, uses first band crs)
+    :param region: GeoJSON coordinates of export region (default: None, uses image footprint,
+                   computed images such as composites and stacks have none)
+    :param region_bounds: tuple of (xmin, ymin, xmax, ymax) of region in crs units
+                          (default: None, bounds of region, required if crs is not geographic)
+    :param max_pixels: Maximum number of pixels in one task (default: 1e10)
+    :param max_bytes: Maximum number of bytes in one task (default: 8 GiB)
+    :param strategy: 'tile' to split the export into tiles within the limits,
+                     'coarsen' to pick the first pyramid level (2x pixel size per level) within the limits
+    :param max_level: Maximum pyramid level for strategy 'coarsen' (default: 8)
+    :returns: ExportPlan object
+    """
+    band = img_prop['bands'][0]
+    native = scale is None and (crs is None or crs == band['crs'])
+    if crs is None:
+        crs = band['crs']
+    band_transform = list(band['crs_transform'])
+
+    if native:
+        grid_transform = band_transform
+    else:
+        if scale is None:
+            # native pixel size in meters, reprojected to crs
+            scale = abs(band_transform[0])
+            if band['crs'] in GEOGRAPHIC_CRS:
+                scale *= METERS_PER_DEGREE
+        # geographic scale is in meters at the equator
+        size = scale / METERS_PER_DEGREE if crs in GEOGRAPHIC_CRS else scale
+        grid_transform = [size, 0, 0, 0, -size, 0]
+
+    if region is None:
+        footprint = img_prop.get('properties', {}).get('system:footprint')
+        if footprint is None:
+            raise RuntimeError('Image {} has no footprint, specify a region to export it'
+                               .format(img_prop.get('id', file_prefix)))
+        region = footprint['coordinates']
+
+    if region_bounds is None:
+        if crs not in GEOGRAPHIC_CRS:
+            raise RuntimeError('Region bounds in {} are required to plan the export'.format(crs))
+        region_bounds = coordinates_bounds(region)
+
+    bytes_per_pixel = sum(band_bytes(band_prop.get('data_type', {})) for band_prop in img_prop['bands'])
+
+    level = 0
+    while True:
+        factor = 2 ** level
+        level_transform = [grid_transform[0] * factor, grid_transform[1], grid_transform[2],
+                           grid_transform[3], grid_transform[4] * factor, grid_transform[5]]
+        col_start, row_start, cols, rows = pixel_window(region_bounds, level_transform)
+        fits = rows * cols <= max_pixels and rows * cols * bytes_per_pixel <= max_bytes
+        if strategy != 'coarsen' or fits or level >= max_level:
+            break
+        level += 1
+
+    if strategy == 'coarsen' and not fits:
+        warnings.warn('Export does not fit at pyramid level {}, splitting into tiles.'.format(level))
+
+    x_size, y_size = level_transform[0], level_transform[4]
+    bounds = (level_transform[2] + col_start * x_size,
+              level_transform[5] + (row_start + rows) * y_size,
+              level_transform[2] + (col_start + cols) * x_size,
+              level_transform[5] + row_start * y_size)
+
+    if native:
+        crs_transform = level_transform
+        scale = None
+    else:
+        crs_transform = None
+        scale = scale * 2 ** level
+
+    plan = ExportPlan(img,
+                      file_prefix,
+                      folder,
+                      crs,
+                      crs_transform,
+                      scale,
+                      region,
+                      bounds,
+                      rows,
+                      cols,
+                      bytes_per_pixel,
+                      level)
+
+    if rows * cols > MAX_TOTAL_PIXELS:
+        warnings.warn('Export of {} pixels exceeds {} pixels, consider strategy="coarsen".'
+                      .format(rows * cols, MAX_TOTAL_PIXELS))
+
+    return plan.split(max_pixels, max_bytes)
@@ -0,0 +1,213 @@
+import ee
+import itertools
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+QA_DTYPE_MAX = 0xFFFF
+
+
+class QALayout(object):
+    """
+    Bit layout of a QA band as named bit flags
+    """
+    def __init__(self,
+                 band,
+                 flags,
+                 bits=16):
+        """
+        :param band: Name of the QA band
+        :param flags: Dictionary of flag name: (start bit, number of bits)
+        :param bits: Number of bits used by the QA band (default: 16)
+                     Unused bits above this are expected to be zero
+        """
+        self.band = band
+        self.flags = flags
+        self.bits = bits
+
+    def __repr__(self):
+        return '<QALayout for band {} with flags: {}>'.format(self.band,
+                                                              ', '.join(sorted(self.flags)))
+
+    def mask(self,
+             **conditions):
+        """
+        Declare a mask over this layout
+        :param conditions: flag name = allowed value or list of allowed values
+                           e.g. cloud=0, cloud_confidence=[0, 1]
+        :returns: QAMask object
+        """
+        return QAMask(self, conditions)
+
+
+class QAMask(object):
+    """
+    Mask declared as allowed values for a set of bit flags in a QA band.
+    On the server, the mask compiles to a single bitwise test on the QA band.
+    Locally, it is a 65,536 entry lookup table over uint16 QA values.
+    """
+    def __init__(self,
+                 layout,
+                 conditions):
+        """
+        :param layout: QALayout object
+        :param conditions: Dictionary of flag name: allowed value or list of allowed values
+        """
+        self.layout = layout
+        self.conditions = {}
+
+        bitmask = 0
+        flag_values = []
+        for flag, values in sorted(conditions.items()):
+            if flag not in layout.flags:
+                raise RuntimeError('Flag {} is not defined for QA band {}'.format(flag, layout.band))
+            start, n_bits = layout.flags[flag]
+            values = sorted(set(values)) if isinstance(values, (list, tuple, set)) else [values]
+            for value in values:
+                if not 0 <= value < 2 ** n_bits:
+                    raise RuntimeError('Value {} out of range for {} bit flag {}'.format(value, n_bits, flag))
+            self.conditions[flag] = values
+            bitmask |= (2 ** n_bits - 1) << start
+            flag_values.append(list(value << start for value in values))
+
+        # unused bits above the layout width must be zero, as they are on the server
+        self.test_bits = (bitmask | (QA_DTYPE_MAX >> layout.bits << layout.bits)) & QA_DTYPE_MAX
+        self.patterns = sorted(sum(combo) for combo in itertools.product(*flag_values))
+        self._lut = None
+
+    def __repr__(self):
+        return '<QAMask on {}: {}>'.format(self.layout.band,
+                                           ', '.join('{}={}'.format(k, v) for k, v in
+                                                     sorted(self.conditions.items())))
+
+    def ee_test(self,
+                qa):
+        """
+        Bitwise test of a QA band on the server
+        :param qa: Single band ee.Image object of QA values
+        :returns: ee.Image object, non-zero where the mask passes
+        """
+        qa = ee.Image(qa)
+        if len(self.patterns) > 1:
+            return qa.bitwiseAnd(self.test_bits).remap(self.patterns, [1] * len(self.patterns), 0)
+
+        value = self.patterns[0]
+        if self.test_bits == QA_DTYPE_MAX:
+            return qa.eq(value)
+        elif value == self.test_bits and (value & (value - 1)) == 0:
+            # test on a single set bit, the bitwise and is already the mask
+            return qa.bitwiseAnd(value)
+        else:
+            return qa.bitwiseAnd(self.test_bits).eq(value)
+
+    def ee_mask(self,
+                img,
+                band=None):
+        """
+        Compute the mask for an ee.Image object containing the QA band
+        :param img: ee.Image object
+        :param band: Name of the QA band in img (default: None, uses layout band name)
+        :returns: ee.Image object, non-zero where the mask passes
+        """
+        return self.ee_test(ee.Image(img).select(band if band is not None else self.layout.band))
+
+    def lookup_table(self):
+        """
+        Boolean lookup table for all 65,536 uint16 QA values, True where the mask passes
+        :returns: numpy array
+        """
+        if np is None:
+            raise RuntimeError('numpy is required for local QA masking')
+        if self._lut is None:
+            codes = np.arange(QA_DTYPE_MAX + 1, dtype=np.uint32) & self.test_bits
+            self._lut = np.isin(codes, self.patterns)
+        return self._lut
+
+    def apply(self,
+              qa_array):
+        """
+        Compute the mask for a local array of QA values
+        :param qa_array: numpy array of QA values (any integer type, read as uint16)
+        :returns: numpy boolean array of the same shape, True where the mask passes
+        """
+        qa_array = np.asarray(qa_array).astype(np.uint16, copy=False)
+        return self.lookup_table()[qa_array]
+
+
+def ee_combined_mask(img,
+                     masks):
+    """
+    Combine masks over one or more QA bands of an ee.Image object
+    :param img: ee.Image object
+    :param masks: List of QAMask objects
+    :returns: ee.Image object, non-zero where all masks pass
+    """
+    out_mask = None
+    for mask in masks:
+        test = mask.ee_mask(img)
+        out_mask = test if out_mask is None else out_mask.And(test)
+    return out_mask
+
+
+def combined_mask(qa_arrays,
+                  masks):
+    """
+    Combine masks over local arrays of one or more QA bands
+    :param qa_arrays: Dictionary of QA band name: numpy array of QA values
+    :param masks: List of QAMask objects
+    :returns: numpy boolean array, True where all masks pass
+    """
+    out_mask = None
+    for mask in masks:
+        test = mask.apply(qa_arrays[mask.layout.band])
+        out_mask = test if out_mask is None else out_mask & test
+    return out_mask
+
+
+# Landsat 4-8 collection 1 surface reflectance QA, band names as in EEHelper.ls_sr_band_correction
+LANDSAT_PIXEL_QA = QALayout('PIXEL_QA',
+                            {'fill': (0, 1),
+                             'clear': (1, 1),
+                             'water': (2, 1),
+                             'cloud_shadow': (3, 1),
+                             'snow': (4, 1),
+                             'cloud': (5, 1),
+                             'cloud_confidence': (6, 2),
+                             'cirrus_confidence': (8, 2),
+                             'terrain_occlusion': (10, 1)})
+
+LANDSAT_RADSAT_QA = QALayout('RADSAT_QA',
+                             {'fill': (0, 1),
+                              'saturation': (1, 11)},
+                             bits=12)
+
+# MODIS surface reflectance 1 km state QA (MOD09GA, MYD09GA)
+MODIS_STATE_1KM = QALayout('state_1km',
+                           {'cloud_state': (0, 2),
+                            'cloud_shadow': (2, 1),
+                            'land_water': (3, 3),
+                            'aerosol': (6, 2),
+                            'cirrus': (8, 2),
+                            'internal_cloud': (10, 1),
+                            'fire': (11, 1),
+                            'snow_ice': (12, 1),
+                            'adjacent_cloud': (13, 1),
+                            'brdf_corrected': (14, 1),
+                            'internal_snow': (15, 1)})
+
+# MODIS land surface temperature QC (MOD11A1, MYD11A1)
+MODIS_LST_QC_DAY = QALayout('QC_Day',
+                            {'mandatory_qa': (0, 2),
+                             'data_quality': (2, 2),
+                             'emissivity_error': (4, 2),
+                             'lst_error': (6, 2)},
+                            bits=8)
+
+LANDSAT_CLEAR = LANDSAT_PIXEL_QA.mask(clear=1)
+LANDSAT_NOT_SATURATED = LANDSAT_RADSAT_QA.mask(fill=0, saturation=0)
+LANDSAT_CLEAR_LAND = LANDSAT_PIXEL_QA.mask(fill=0, water=0, cloud_shadow=0, snow=0, cloud=0)
+MODIS_CLEAR = MODIS_STATE_1KM.mask(cloud_state=0, cloud_shadow=0, cirrus=[0, 1], internal_cloud=0)
+MODIS_LST_GOOD = MODIS_LST_QC_DAY.mask(mandatory_qa=0)
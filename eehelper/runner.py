@@ -0,0 +1,486 @@
+import ee
+import os
+import sys
+import json
+import time
+import socket
+import sqlite3
+import warnings
+import functools
+import threading
+import traceback
+import multiprocessing
+from eehelper.eehelper import EEHelper
+
+
+# julian days for all months
+MONTHS = [['jan', (1, 31)],
+          ['feb', (32, 59)],
+          ['mar', (60, 90)],
+          ['apr', (91, 120)],
+          ['may', (121, 151)],
+          ['jun', (152, 181)],
+          ['jul', (182, 212)],
+          ['aug', (213, 243)],
+          ['sep', (244, 273)],
+          ['oct', (274, 304)],
+          ['nov', (305, 334)],
+          ['dec', (335, 365)]]
+
+# final states of ee.batch.Task
+TASK_FINAL_STATES = ('COMPLETED', 'FAILED', 'CANCELLED')
+
+
+def window_grid(years,
+                julian_days=None):
+    """
+    Make year x julian window grid
+    :param years: List of years
+    :param julian_days: List of [label, (start julian day, end julian day)] (default: None, all months)
+    :returns: List of dictionaries with keys year, label, start_julian, end_julian
+    """
+    julian_days = julian_days if julian_days is not None else MONTHS
+    return list({'year': year, 'label': label, 'start_julian': days[0], 'end_julian': days[1]}
+                for year in years for label, days in julian_days)
+
+
+def work_items(name,
+               windows,
+               spec):
+    """
+    Make work items from a window grid and a composite/export spec
+    :param name: Name of the job, used in item ids and output file names
+    :param windows: List of windows from window_grid()
+    :param spec: Dictionary of composite/export parameters shared by all items, see composite_export_item()
+    :returns: List of (item id, payload dictionary)
+    """
+    items = []
+    for window in windows:
+        item_id = '{}_y{}_{}'.format(name, window['year'], window['label'])
+        payload = dict(spec)
+        payload.update(window)
+        payload['file_prefix'] = item_id
+        items.append((item_id, payload))
+    return items
+
+
+class WorkItem(object):
+    """
+    Work item claimed from a WorkQueue
+    """
+    def __init__(self,
+                 item_id,
+                 payload,
+                 attempts,
+                 worker):
+        self.item_id = item_id
+        self.payload = payload
+        self.attempts = attempts
+        self.worker = worker
+
+    def __repr__(self):
+        return '<WorkItem {} (attempt {}, worker {})>'.format(self.item_id, self.attempts, self.worker)
+
+
+class WorkQueue(object):
+    """
+    Work queue in a SQLite database file, shared by worker processes on one machine or
+    on several machines with a shared filesystem that supports file locks.
+    Workers claim items with a lease, extend it with heartbeats while working, and record
+    a result or a failure. Items whose lease expires are claimed again by other workers.
+    Failed items are retried until max_attempts, which is stored in the database file
+    so every worker opening the queue by path uses the same value.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    DEFAULT_MAX_ATTEMPTS = 3
+
+    def __init__(self,
+                 path,
+                 max_attempts=None,
+                 timeout=60):
+        """
+        :param path: SQLite database file, created if it does not exist
+        :param max_attempts: Number of attempts before an item is marked failed, stored when the
+                             queue is created (default: None, stored value or 3 for a new queue)
+        :param timeout: Seconds to wait for the database lock (default: 60)
+        """
+        self.path = path
+        self.timeout = timeout
+
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS items ('
+                         'id TEXT PRIMARY KEY, '
+                         'payload TEXT NOT NULL, '
+                         'state TEXT NOT NULL, '
+                         'attempts INTEGER NOT NULL DEFAULT 0, '
+                         'worker TEXT, '
+                         'lease_until REAL, '
+                         'result TEXT, '
+                         'error TEXT, '
+                         'updated REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_until)')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+            conn.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)',
+                         ('max_attempts', json.dumps(max_attempts if max_attempts is not None
+                                                     else self.DEFAULT_MAX_ATTEMPTS)))
+            self.max_attempts = json.loads(conn.execute('SELECT value FROM meta WHERE key = ?',
+                                                        ('max_attempts',)).fetchone()[0])
+
+        if max_attempts is not None and max_attempts != self.max_attempts:
+            warnings.warn('Queue {} was created with max_attempts={}, ignoring max_attempts={}.'
+                          .format(path, self.max_attempts, max_attempts))
+
+    def __repr__(self):
+        return '<WorkQueue {}: {}>'.format(self.path, ', '.join('{} {}'.format(v, k)
+                                                                for k, v in sorted(self.counts().items())))
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA busy_timeout = {}'.format(int(self.timeout * 1000)))
+        return _Transaction(conn)
+
+    def put(self,
+            items):
+        """
+        Add work items; items with an id already in the queue are skipped
+        :param items: List of (item id, payload dictionary)
+        :returns: Number of items added
+        """
+        now = time.time()
+        with self._connect() as conn:
+            before = conn.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+            conn.executemany('INSERT OR IGNORE INTO items (id, payload, state, updated) VALUES (?, ?, ?, ?)',
+                             list((item_id, json.dumps(payload), self.PENDING, now) for item_id, payload in items))
+            return conn.execute('SELECT COUNT(*) FROM items').fetchone()[0] - before
+
+    def claim(self,
+              worker,
+              lease_seconds=300):
+        """
+        Claim the next pending item, or a running item whose lease expired
+        :param worker: Worker id
+        :param lease_seconds: Seconds the item stays claimed without a heartbeat (default: 300)
+        :returns: WorkItem object, or None if no item is available
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # items that ran out of attempts while their worker was lost
+            conn.execute('UPDATE items SET state = ?, error = ?, updated = ? '
+                         'WHERE state = ? AND lease_until < ? AND attempts >= ?',
+                         (self.FAILED, 'lease expired', now, self.RUNNING, now, self.max_attempts))
+
+            row = conn.execute('SELECT id, payload, attempts FROM items '
+                               'WHERE state = ? OR (state = ? AND lease_until < ?) '
+                               'ORDER BY attempts, updated LIMIT 1',
+                               (self.PENDING, self.RUNNING, now)).fetchone()
+            if row is None:
+                return None
+
+            item_id, payload, attempts = row
+            conn.execute('UPDATE items SET state = ?, worker = ?, lease_until = ?, attempts = ?, updated = ? '
+                         'WHERE id = ?',
+                         (self.RUNNING, worker, now + lease_seconds, attempts + 1, now, item_id))
+
+        return WorkItem(item_id, json.loads(payload), attempts + 1, worker)
+
+    def heartbeat(self,
+                  item,
+                  lease_seconds=300):
+        """
+        Extend the lease of a claimed item
+        :param item: WorkItem object
+        :param lease_seconds: Seconds from now the item stays claimed (default: 300)
+        :returns: True if the item is still claimed by this worker
+        """
+        now = time.time()
+        with self._connect() as conn:
+            return conn.execute('UPDATE items SET lease_until = ?, updated = ? '
+                                'WHERE id = ? AND worker = ? AND state = ?',
+                                (now + lease_seconds, now, item.item_id, item.worker, self.RUNNING)).rowcount == 1
+
+    def complete(self,
+                 item,
+                 result=None):
+        """
+        Record the result of a claimed item
+        :param item: WorkItem object
+        :param result: JSON serializable result
+        :returns: True if the result was recorded, False if the item was claimed by another worker
+        """
+        with self._connect() as conn:
+            return conn.execute('UPDATE items SET state = ?, result = ?, error = NULL, lease_until = NULL, '
+                                'updated = ? WHERE id = ? AND worker = ? AND state = ?',
+                                (self.DONE, json.dumps(result), time.time(), item.item_id, item.worker,
+                                 self.RUNNING)).rowcount == 1
+
+    def fail(self,
+             item,
+             error):
+        """
+        Record a failed attempt; the item is retried until max_attempts
+        :param item: WorkItem object
+        :param error: Error message
+        :returns: State of the item after the failure
+        """
+        state = self.PENDING if item.attempts < self.max_attempts else self.FAILED
+        with self._connect() as conn:
+            conn.execute('UPDATE items SET state = ?, error = ?, lease_until = NULL, updated = ? '
+                         'WHERE id = ? AND worker = ? AND state = ?',
+                         (state, str(error), time.time(), item.item_id, item.worker, self.RUNNING))
+        return state
+
+    def reset_failed(self):
+        """
+        Put failed items back in the queue with no attempts
+        :returns: Number of items reset
+        """
+        with self._connect() as conn:
+            return conn.execute('UPDATE items SET state = ?, attempts = 0, updated = ? WHERE state = ?',
+                                (self.PENDING, time.time(), self.FAILED)).rowcount
+
+    def counts(self):
+        """
+        Number of items in each state
+        :returns: Dictionary of state: number of items
+        """
+        with self._connect() as conn:
+            return dict(conn.execute('SELECT state, COUNT(*) FROM items GROUP BY state').fetchall())
+
+    def results(self,
+                state=DONE):
+        """
+        Results (or errors, for failed items) recorded in the queue
+        :param state: State of the items (default: 'done')
+        :returns: Dictionary of item id: result
+        """
+        with self._connect() as conn:
+            rows = conn.execute('SELECT id, result, error FROM items WHERE state = ? ORDER BY id',
+                                (state,)).fetchall()
+        return dict((item_id, json.loads(result) if result is not None else error)
+                    for item_id, result, error in rows)
+
+
+class _Transaction(object):
+    """
+    Connection context holding a write lock (BEGIN IMMEDIATE) for the duration of the block
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+        finally:
+            self.conn.close()
+
+
+def default_worker_id():
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(), threading.current_thread().ident)
+
+
+def run_worker(queue,
+               func,
+               worker=None,
+               lease_seconds=300,
+               heartbeat_seconds=60,
+               max_items=None,
+               init_func=None,
+               timeout=60,
+               verbose=False):
+    """
+    Claim and process items from a queue until it is empty
+    :param queue: WorkQueue object, or path to its database file
+    :param func: Function called with the item payload, its return value is recorded as result
+    :param worker: Worker id (default: None, uses host:pid:thread)
+    :param lease_seconds: Seconds an item stays claimed without a heartbeat (default: 300)
+    :param heartbeat_seconds: Seconds between heartbeats while an item is processed (default: 60)
+    :param max_items: Maximum number of items to process (default: None, until queue is empty)
+    :param init_func: Function called without arguments once before the first item,
+                      e.g. ee_initializer(project=...) (default: None)
+    :param timeout: Seconds to wait for the database lock if queue is a path (default: 60)
+    :param verbose: If some steps should be displayed (default: False)
+    :returns: Number of items processed
+    """
+    if not isinstance(queue, WorkQueue):
+        queue = WorkQueue(queue, timeout=timeout)
+    worker = worker if worker is not None else default_worker_id()
+
+    if init_func is not None:
+        init_func()
+
+    n_items = 0
+    while max_items is None or n_items < max_items:
+        item = queue.claim(worker, lease_seconds)
+        if item is None:
+            break
+
+        if verbose:
+            sys.stdout.write('{}: processing {}\n'.format(worker, repr(item)))
+
+        stop = threading.Event()
+        beat = threading.Thread(target=_heartbeat, args=(queue, item, lease_seconds, heartbeat_seconds, stop))
+        beat.daemon = True
+        beat.start()
+        try:
+            result = func(item.payload)
+        except Exception:
+            stop.set()
+            beat.join()
+            state = queue.fail(item, traceback.format_exc())
+            if verbose:
+                sys.stdout.write('{}: {} failed, now {}\n'.format(worker, item.item_id, state))
+        else:
+            stop.set()
+            beat.join()
+            queue.complete(item, result)
+        n_items += 1
+
+    return n_items
+
+
+def _heartbeat(queue, item, lease_seconds, heartbeat_seconds, stop):
+    while not stop.wait(heartbeat_seconds):
+        if not queue.heartbeat(item, lease_seconds):
+            break
+
+
+def run_workers(path,
+                func,
+                processes=4,
+                context=None,
+                **kwargs):
+    """
+    Process a queue with several worker processes on this machine.
+    Run the same on other machines sharing the queue file to scale further.
+
+    :param path: Path to the WorkQueue database file
+    :param func: Function called with each item payload, must be importable by the worker processes
+    :param processes: Number of worker processes (default: 4)
+    :param context: multiprocessing context (default: None, platform default)
+    :param kwargs: Keyword arguments for run_worker(), e.g. init_func=ee_initializer() or timeout,
+                   func and init_func must be picklable with a spawn context
+    :returns: Dictionary of item counts in each state after all workers finish
+    """
+    context = context if context is not None else multiprocessing
+    workers = list(context.Process(target=run_worker, args=(path, func), kwargs=kwargs)
+                   for _ in range(processes))
+    for proc in workers:
+        proc.start()
+    for proc in workers:
+        proc.join()
+    return WorkQueue(path, timeout=kwargs.get('timeout', 60)).counts()
+
+
+def ee_initializer(**kwargs):
+    """
+    Earth Engine initialization for init_func of run_worker() and run_workers()
+    :param kwargs: Keyword arguments for ee.Initialize() (e.g. project, opt_url)
+    :returns: Function calling ee.Initialize(**kwargs)
+    """
+    return functools.partial(ee.Initialize, **kwargs)
+
+
+def wait_for_tasks(tasks,
+                   poll_seconds=30):
+    """
+    Wait until started export tasks reach a final state
+    :param tasks: List of started ee.batch.Task objects
+    :param poll_seconds: Seconds between status requests (default: 30)
+    :returns: List of final status dictionaries, in task order
+    """
+    statuses = [None] * len(tasks)
+    while True:
+        for task_indx, task in enumerate(tasks):
+            if statuses[task_indx] is None:
+                status = task.status()
+                if status.get('state') in TASK_FINAL_STATES:
+                    statuses[task_indx] = status
+        if all(status is not None for status in statuses):
+            return statuses
+        time.sleep(poll_seconds)
+
+
+def composite_export_item(payload):
+    """
+    Composite one window of a collection, export it to google drive and wait for the
+    export tasks, as in tests/extract_GPM_LST_data.py. Use as func for run_worker() with
+    items from work_items(), Earth Engine must be initialized in the worker (see ee_initializer()).
+    The worker heartbeat keeps the item claimed while the tasks run; if a task fails
+    the item fails and is retried by the queue.
+
+    :param payload: Dictionary with keys
+                        collection: collection id
+                        year, start_julian, end_julian, file_prefix: from work_items()
+                        bands: list of bands to select from the collection (optional)
+                        band_selector, band_names: for EEHelper.composite_image (optional)
+                        composite_function, composite_index, scale_factor: for EEHelper (optional)
+                        map: EEHelper function to map over the collection (optional)
+                        region: GeoJSON polygon coordinates to composite and export,
+                                required since composites have no footprint
+                        folder, scale, crs: for EEHelper.export_image_to_drive (optional)
+                        metadata_folder: local folder for image metadata (optional, default: '.')
+                        poll_seconds: seconds between task status requests (optional, default: 30)
+    :returns: Dictionary with number of images and id, description and state of the export tasks
+    """
+    if payload.get('region') is None:
+        raise RuntimeError('Work item {} has no region, composites have no footprint to export'
+                           .format(payload.get('file_prefix')))
+
+    helper = EEHelper(scale_factor=payload.get('scale_factor', 1),
+                      composite_index=payload.get('composite_index'),
+                      composite_function=payload.get('composite_function', 'median'))
+
+    collection = ee.ImageCollection(payload['collection'])
+    if payload.get('bands') is not None:
+        collection = collection.select(payload['bands'])
+
+    region = ee.Geometry.Polygon(payload['region'], None, False)
+    kwargs = {'map': payload['map']} if payload.get('map') is not None else {}
+
+    coll = helper.get_images(collection,
+                             bounds=region,
+                             year=payload['year'],
+                             start_julian=payload['start_julian'],
+                             end_julian=payload['end_julian'],
+                             **kwargs)
+
+    n_images = coll.size().getInfo()
+    if n_images == 0:
+        return {'images': 0, 'tasks': []}
+
+    composite = helper.composite_image(coll,
+                                       region=region,
+                                       band_selector=payload.get('band_selector'),
+                                       band_names=payload.get('band_names'))
+
+    export_plan = EEHelper.export_image_to_drive(composite,
+                                                 folder=payload.get('folder'),
+                                                 scale=payload.get('scale'),
+                                                 crs=payload.get('crs'),
+                                                 region=region,
+                                                 metadata_folder=payload.get('metadata_folder', '.'),
+                                                 file_prefix=payload['file_prefix'])
+
+    tasks = export_plan.tasks
+    statuses = wait_for_tasks(tasks, payload.get('poll_seconds', 30))
+
+    task_results = list({'id': task.id,
+                         'description': task.config.get('description'),
+                         'state': status.get('state')}
+                        for task, status in zip(tasks, statuses))
+
+    failed = list(status for status in statuses if status.get('state') != 'COMPLETED')
+    if len(failed) > 0:
+        raise RuntimeError('Export tasks did not complete: {}'.format(
+            ', '.join('{} {} ({})'.format(status.get('id'), status.get('state'), status.get('error_message', ''))
+                      for status in failed)))
+
+    return {'images': n_images,
+            'tasks': task_results}
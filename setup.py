@@ -29,5 +29,8 @@ setuptools.setup(
     install_requires=[
         'earthengine-api>=0.1.175',
     ],
+    extras_require={
+        'local': ['numpy'],
+    },
     keywords='geospatial earthengine spatial google earth science satellite landsat modis',
 )
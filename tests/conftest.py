@@ -0,0 +1,20 @@
+"""
+Test configuration: all tests run offline against the recording fake ee module
+"""
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_ee
+
+fake_ee.install()
+
+
+@pytest.fixture
+def recorder():
+    """
+    Fresh fake ee Recorder for each test
+    """
+    return fake_ee.install(fake_ee.Recorder())
@@ -0,0 +1,545 @@
+"""
+Recording stand-in for the Google Earth Engine python API (ee module)
+
+Every call on a fake ee object builds a node in an expression graph the same way
+the real client library does, without contacting the server. getInfo(),
+Task.start() and Task.status() are the only server round trips; they are counted
+by the Recorder and answered with canned metadata so EEHelper code paths run offline.
+
+Usage:
+    import fake_ee
+    recorder = fake_ee.install()   # registers the fake as sys.modules['ee']
+    ...
+    fake_ee.graph_stats(ee_object) # node count and serialized size of a graph
+"""
+import sys
+import json
+import types
+
+
+class Recorder(object):
+    """
+    Counts server round trips and holds the canned responses returned by getInfo()
+    """
+    def __init__(self,
+                 collection_size=100,
+                 crs='EPSG:4326',
+                 crs_transform=None,
+                 band_names=None,
+                 footprint=None,
+                 task_state='COMPLETED'):
+        """
+        :param collection_size: Value returned for size() and length() requests
+        :param crs: CRS string reported for every band
+        :param crs_transform: Affine transform reported for every band
+        :param band_names: Band names reported by image metadata
+        :param footprint: Coordinates of the system:footprint property
+        :param task_state: State reported by status() of started tasks
+        """
+        self.collection_size = collection_size
+        self.crs = crs
+        self.crs_transform = crs_transform if crs_transform is not None \
+            else [0.01, 0.0, -151.0, 0.0, -0.01, 68.0]
+        self.band_names = band_names if band_names is not None else ['b1']
+        self.footprint = footprint if footprint is not None \
+            else [[-151.0, 68.0], [-151.0, 63.0], [-141.0, 63.0], [-141.0, 68.0], [-151.0, 68.0]]
+        self.task_state = task_state
+        self.getinfo_calls = 0
+        self.status_calls = 0
+        self.tasks = []
+        self.image_counter = 0
+
+    def __repr__(self):
+        return '<Recorder: {} getInfo calls, {} tasks>'.format(self.getinfo_calls,
+                                                               len(self.tasks))
+
+    def reset(self):
+        """
+        Clear all counters
+        """
+        self.getinfo_calls = 0
+        self.status_calls = 0
+        self.tasks = []
+        self.image_counter = 0
+
+    @property
+    def tasks_started(self):
+        return sum(1 for task in self.tasks if task.started)
+
+    @property
+    def round_trips(self):
+        return self.getinfo_calls + self.tasks_started + self.status_calls
+
+    def image_info(self,
+                   asset=True):
+        """
+        Canned ee.Image metadata dictionary
+        :param asset: If the image is an asset (or a collection element) with an id and properties,
+                      computed images (toBands, reduce, clip, ...) only report their bands
+        """
+        info = {'type': 'Image',
+                'bands': list({'id': name,
+                               'data_type': {'type': 'PixelType', 'precision': 'int',
+                                             'min': 0, 'max': 65535},
+                               'crs': self.crs,
+                               'crs_transform': list(self.crs_transform)}
+                              for name in self.band_names)}
+        if asset:
+            self.image_counter += 1
+            info['id'] = 'FAKE/COLLECTION/IMAGE_{:06d}'.format(self.image_counter)
+            info['properties'] = {'system:footprint': {'type': 'LinearRing',
+                                                       'coordinates': self.footprint},
+                                  'system:index': 'IMAGE_{:06d}'.format(self.image_counter)}
+        return info
+
+    def resolve(self, obj):
+        """
+        Answer a getInfo() request for an ee object
+        :param obj: ComputedObject
+        """
+        self.getinfo_calls += 1
+        return self._value(obj)
+
+    def _value(self, obj):
+        if isinstance(obj, (list, tuple)):
+            return list(self._value(v) for v in obj)
+        if isinstance(obj, dict):
+            return dict((k, self._value(v)) for k, v in obj.items())
+        if not isinstance(obj, ComputedObject):
+            return obj
+
+        func = obj.func or ''
+        if func.endswith('.size') or func.endswith('.length'):
+            return self.collection_size
+        if func.endswith('.aggregate_array'):
+            return list('IMAGE_{:06d}'.format(indx) for indx in range(self.collection_size))
+        if func.endswith('.bandNames'):
+            return list(self.band_names)
+        if func in ('Dictionary', 'List', 'Number', 'String'):
+            return self._value(obj.args['value'])
+        if isinstance(obj, Image):
+            return self.image_info(func in ASSET_IMAGE_FUNCS)
+        if func == 'Geometry.bounds':
+            # no reprojection: bounding box in the coordinates of the input geometry
+            coords = self._value(obj.args['this'])['coordinates']
+            while isinstance(coords[0][0], (list, tuple)):
+                coords = [point for part in coords for point in part]
+            x_coords, y_coords = list(p[0] for p in coords), list(p[1] for p in coords)
+            xmin, ymin, xmax, ymax = min(x_coords), min(y_coords), max(x_coords), max(y_coords)
+            return {'type': 'Polygon',
+                    'coordinates': [[[xmin, ymax], [xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax]]]}
+        if isinstance(obj, Geometry):
+            return obj.args.get('geojson')
+        if isinstance(obj, Feature):
+            return {'type': 'Feature', 'geometry': None, 'properties': {}}
+        if isinstance(obj, List):
+            return list(range(self.collection_size))
+        return None
+
+
+RECORDER = Recorder()
+
+# images that carry asset metadata: loaded assets and elements taken from a collection
+ASSET_IMAGE_FUNCS = ('Image.load', 'List.get', 'Collection.first', 'ImageCollection.first')
+
+_MAPPING_DEPTH = [0]
+
+
+class ComputedObject(object):
+    """
+    Node in the expression graph: a function name applied to named arguments
+    """
+    name = 'ComputedObject'
+
+    # return types of methods that do not return the type of the caller
+    _returns = {}
+
+    def __init__(self, func=None, args=None, var_name=None):
+        self.func = func
+        self.args = args if args is not None else {}
+        self.var_name = var_name
+
+    @classmethod
+    def _call(cls, func, args):
+        obj = cls.__new__(cls)
+        ComputedObject.__init__(obj, func, args)
+        return obj
+
+    def __getattr__(self, method_name):
+        if method_name.startswith('_'):
+            raise AttributeError(method_name)
+
+        def method(*args, **kwargs):
+            out_type = self._returns.get(method_name, type(self))
+            return out_type._call('{}.{}'.format(self.name, method_name),
+                                  _named_args(self, args, kwargs))
+        return method
+
+    def __repr__(self):
+        return '<fake ee.{} {}>'.format(self.name, self.func or self.var_name)
+
+    def getInfo(self):
+        return RECORDER.resolve(self)
+
+
+def _named_args(this, args, kwargs):
+    named = {'this': this} if this is not None else {}
+    for indx, arg in enumerate(args):
+        named['arg{}'.format(indx)] = arg
+    named.update(kwargs)
+    return named
+
+
+def _map_function(element_type, func):
+    """
+    Trace a python callable over a placeholder element, as ee does for map()
+    """
+    _MAPPING_DEPTH[0] += 1
+    var_name = '_MAPPING_VAR_{}_0'.format(_MAPPING_DEPTH[0])
+    try:
+        body = func(element_type(ComputedObject(var_name=var_name)))
+    finally:
+        _MAPPING_DEPTH[0] -= 1
+    return Function(var_name, body)
+
+
+class Function(object):
+    """
+    Traced python callable
+    """
+    def __init__(self, var_name, body):
+        self.var_name = var_name
+        self.body = body
+
+
+class Number(ComputedObject):
+    name = 'Number'
+
+    def __init__(self, arg=None):
+        if isinstance(arg, ComputedObject):
+            ComputedObject.__init__(self, arg.func, arg.args, arg.var_name)
+        else:
+            ComputedObject.__init__(self, 'Number', {'value': arg})
+
+
+class String(ComputedObject):
+    name = 'String'
+
+    def __init__(self, arg=None):
+        if isinstance(arg, ComputedObject):
+            ComputedObject.__init__(self, arg.func, arg.args, arg.var_name)
+        else:
+            ComputedObject.__init__(self, 'String', {'value': arg})
+
+
+class Dictionary(ComputedObject):
+    name = 'Dictionary'
+
+    def __init__(self, arg=None):
+        if isinstance(arg, ComputedObject):
+            ComputedObject.__init__(self, arg.func, arg.args, arg.var_name)
+        else:
+            ComputedObject.__init__(self, 'Dictionary', {'value': arg})
+
+
+class List(ComputedObject):
+    name = 'List'
+
+    def __init__(self, arg=None):
+        if isinstance(arg, ComputedObject):
+            ComputedObject.__init__(self, arg.func, arg.args, arg.var_name)
+        else:
+            ComputedObject.__init__(self, 'List', {'value': arg})
+
+    @staticmethod
+    def sequence(start, end=None, step=None, count=None):
+        return List._call('List.sequence', {'start': start, 'end': end, 'step': step, 'count': count})
+
+    def map(self, func):
+        return List._call('List.map', {'list': self, 'baseAlgorithm': _map_function(ComputedObject, func)})
+
+
+class Filter(ComputedObject):
+    name = 'Filter'
+
+    def __init__(self, arg=None):
+        ComputedObject.__init__(self, 'Filter', {'value': arg})
+
+    @staticmethod
+    def calendarRange(start, end=None, field='day_of_year'):
+        return Filter._call('Filter.calendarRange', {'start': start, 'end': end, 'field': field})
+
+
+class _Reducer(ComputedObject):
+    name = 'Reducer'
+
+
+class Geometry(ComputedObject):
+    name = 'Geometry'
+
+    def __init__(self, geojson=None, proj=None, geodesic=None):
+        if isinstance(geojson, ComputedObject):
+            ComputedObject.__init__(self, geojson.func, geojson.args, geojson.var_name)
+        else:
+            ComputedObject.__init__(self, 'GeometryConstructors.{}'.format(geojson['type']),
+                                    {'geojson': geojson, 'geodesic': geodesic})
+
+    @staticmethod
+    def Polygon(coords, proj=None, geodesic=None, maxError=None, evenOdd=None):
+        return Geometry({'type': 'Polygon', 'coordinates': coords}, proj, geodesic)
+
+    @staticmethod
+    def Rectangle(coords, proj=None, geodesic=None, maxError=None, evenOdd=None):
+        xmin, ymin, xmax, ymax = coords
+        return Geometry({'type': 'Polygon',
+                         'coordinates': [[[xmin, ymax], [xmin, ymin], [xmax, ymin], [xmax, ymax]]]},
+                        proj, geodesic)
+
+
+class Element(ComputedObject):
+    name = 'Element'
+
+
+class Image(ComputedObject):
+    name = 'Image'
+
+    def __init__(self, arg=None, version=None):
+        if isinstance(arg, ComputedObject):
+            ComputedObject.__init__(self, arg.func, arg.args, arg.var_name)
+        elif isinstance(arg, (int, float)):
+            ComputedObject.__init__(self, 'Image.constant', {'value': arg})
+        elif arg is None:
+            ComputedObject.__init__(self, 'Image.mask', {'value': 0})
+        else:
+            ComputedObject.__init__(self, 'Image.load', {'id': arg, 'version': version})
+
+    @staticmethod
+    def cat(*images):
+        return Image._call('Image.cat', {'images': list(images)})
+
+
+class Feature(ComputedObject):
+    name = 'Feature'
+
+    def __init__(self, geom=None, opt_properties=None):
+        if isinstance(geom, ComputedObject) and not isinstance(geom, Geometry):
+            ComputedObject.__init__(self, geom.func, geom.args, geom.var_name)
+        else:
+            ComputedObject.__init__(self, 'Feature', {'geometry': geom, 'metadata': opt_properties})
+
+
+class Collection(ComputedObject):
+    name = 'Collection'
+    element_type = Element
+
+    def map(self, func):
+        return type(self)._call('Collection.map',
+                                {'collection': self,
+                                 'baseAlgorithm': _map_function(self.element_type, func)})
+
+    def iterate(self, func, first=None):
+        return ComputedObject._call('Collection.iterate',
+                                    {'collection': self,
+                                     'function': Function('_MAPPING_VAR_ITER',
+                                                          func(self.element_type(ComputedObject(
+                                                              var_name='_MAPPING_VAR_ITER')),
+                                                               ComputedObject(var_name='_MAPPING_VAR_ITER_1'))),
+                                     'first': first})
+
+
+class ImageCollection(Collection):
+    name = 'ImageCollection'
+    element_type = Image
+
+    def __init__(self, arg=None):
+        if isinstance(arg, ComputedObject):
+            ComputedObject.__init__(self, arg.func, arg.args, arg.var_name)
+        elif isinstance(arg, (list, tuple)):
+            ComputedObject.__init__(self, 'ImageCollection.fromImages', {'images': list(arg)})
+        else:
+            ComputedObject.__init__(self, 'ImageCollection.load', {'id': arg})
+
+
+class FeatureCollection(Collection):
+    name = 'FeatureCollection'
+    element_type = Feature
+
+    def __init__(self, arg=None):
+        if isinstance(arg, ComputedObject):
+            ComputedObject.__init__(self, arg.func, arg.args, arg.var_name)
+        elif isinstance(arg, (list, tuple)):
+            ComputedObject.__init__(self, 'Collection', {'features': list(arg)})
+        else:
+            ComputedObject.__init__(self, 'Collection.loadTable', {'tableId': arg})
+
+
+ComputedObject._returns = {'size': Number, 'length': Number, 'compareTo': Number,
+                           'toList': List, 'bandNames': List, 'aggregate_array': List, 'removeAll': List, 'keys': List,
+                           'get': ComputedObject, 'first': Element,
+                           'toDictionary': Dictionary, 'reduceColumns': Dictionary,
+                           'reduceRegion': Dictionary, 'toBands': Image,
+                           'geometry': Geometry, 'bounds': Geometry}
+Collection._returns = dict(ComputedObject._returns, reduce=Image, qualityMosaic=Image, mosaic=Image,
+                           median=Image, mean=Image, sum=Image, min=Image, max=Image, count=Image)
+ImageCollection._returns = dict(Collection._returns, first=Image)
+FeatureCollection._returns = dict(Collection._returns, first=Feature)
+Image._returns = dict(ComputedObject._returns, reduceRegions=FeatureCollection, sample=FeatureCollection,
+                      sampleRegions=FeatureCollection)
+Geometry._returns = dict(ComputedObject._returns, bounds=Geometry, buffer=Geometry)
+Feature._returns = dict(ComputedObject._returns, buffer=Feature, bounds=Feature)
+
+
+class _Namespace(object):
+    """
+    Static algorithm namespace such as ee.Reducer or ee.Terrain
+    """
+    def __init__(self, name, out_type):
+        self._name = name
+        self._out_type = out_type
+
+    def __getattr__(self, func_name):
+        if func_name.startswith('_'):
+            raise AttributeError(func_name)
+
+        def func(*args, **kwargs):
+            return self._out_type._call('{}.{}'.format(self._name, func_name),
+                                        _named_args(None, args, kwargs))
+        return func
+
+
+class Task(object):
+    """
+    Batch export task; start() is one server round trip
+    """
+    def __init__(self, task_type, config):
+        self.task_type = task_type
+        self.config = config
+        self.started = False
+        self.id = None
+        RECORDER.tasks.append(self)
+
+    def __repr__(self):
+        return '<fake ee Task {} {}>'.format(self.task_type, self.config.get('description'))
+
+    def start(self):
+        self.started = True
+        self.id = 'FAKETASK{:06d}'.format(RECORDER.tasks_started)
+
+    def status(self):
+        if not self.started:
+            return {'state': 'UNSUBMITTED', 'description': self.config.get('description')}
+        RECORDER.status_calls += 1
+        status = {'state': RECORDER.task_state, 'id': self.id, 'description': self.config.get('description')}
+        if RECORDER.task_state == 'FAILED':
+            status['error_message'] = 'Export failed on the fake server.'
+        return status
+
+
+class _ExportTarget(object):
+    def __init__(self, task_type):
+        self._task_type = task_type
+
+    def __getattr__(self, destination):
+        if destination.startswith('_'):
+            raise AttributeError(destination)
+
+        def export(*args, **kwargs):
+            return Task('{}.{}'.format(self._task_type, destination), kwargs)
+        return export
+
+
+class _Export(object):
+    image = _ExportTarget('EXPORT_IMAGE')
+    table = _ExportTarget('EXPORT_FEATURES')
+    video = _ExportTarget('EXPORT_VIDEO')
+
+
+def Initialize(*args, **kwargs):
+    pass
+
+
+def _encode(obj, values, memo):
+    """
+    Encode obj into the compact ee serialization format, adding each distinct
+    node to values, and return the value that references it
+    """
+    if isinstance(obj, ComputedObject):
+        if obj.var_name is not None and obj.func is None:
+            return {'argumentReference': obj.var_name}
+        key = id(obj)
+        if key not in memo:
+            arguments = dict((k, _encode(v, values, memo)) for k, v in sorted(obj.args.items())
+                             if v is not None)
+            node = {'functionInvocationValue': {'functionName': obj.func, 'arguments': arguments}}
+            # obj is kept in the memo so its id cannot be reused during encoding
+            memo[key] = (_intern(node, values), obj)
+        return {'valueReference': memo[key][0]}
+    if isinstance(obj, Function):
+        node = {'functionDefinitionValue': {'argumentNames': [obj.var_name],
+                                            'body': _encode(obj.body, values, memo)['valueReference']}}
+        return {'valueReference': _intern(node, values)}
+    if isinstance(obj, (list, tuple)):
+        encoded = list(_encode(v, values, memo) for v in obj)
+        if all('constantValue' in v for v in encoded):
+            return {'constantValue': list(v['constantValue'] for v in encoded)}
+        return {'arrayValue': {'values': encoded}}
+    if isinstance(obj, dict):
+        encoded = dict((str(k), _encode(v, values, memo)) for k, v in obj.items())
+        if all('constantValue' in v for v in encoded.values()):
+            return {'constantValue': dict((k, v['constantValue']) for k, v in encoded.items())}
+        return {'dictionaryValue': {'values': encoded}}
+    if isinstance(obj, types.FunctionType):
+        raise TypeError('Untraced python function in graph: {}'.format(obj))
+    return {'constantValue': obj}
+
+
+def _intern(node, values):
+    text = json.dumps(node, sort_keys=True)
+    if text not in values:
+        values[text] = str(len(values))
+    return values[text]
+
+
+def serialize(obj):
+    """
+    Serialize an ee object into the compact expression format
+    :param obj: ComputedObject or any python value containing ComputedObjects
+    :returns: dictionary with 'result' reference and 'values' table
+    """
+    values, memo = {}, {}
+    result = _encode(obj, values, memo)
+    table = dict((key, json.loads(text)) for text, key in values.items())
+    return {'result': result.get('valueReference', result), 'values': table}
+
+
+def graph_stats(obj):
+    """
+    Size of the expression graph behind an ee object
+    :param obj: ComputedObject or any python value containing ComputedObjects
+    :returns: dictionary with number of distinct nodes and serialized size in bytes
+    """
+    graph = serialize(obj)
+    return {'nodes': len(graph['values']),
+            'bytes': len(json.dumps(graph, sort_keys=True, separators=(',', ':')))}
+
+
+def install(recorder=None):
+    """
+    Register the fake as the ee module
+    :param recorder: Recorder object to answer server requests (default: new Recorder)
+    :returns: Recorder object
+    """
+    global RECORDER
+    RECORDER = recorder if recorder is not None else Recorder()
+    sys.modules['ee'] = sys.modules[__name__]
+    return RECORDER
+
+
+Terrain = _Namespace('Terrain', Image)
+Algorithms = _Namespace('Algorithms', ComputedObject)
+Reducer = _Namespace('Reducer', _Reducer)
+
+
+class batch(object):
+    Export = _Export
+    Task = Task
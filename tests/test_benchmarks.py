@@ -0,0 +1,283 @@
+"""
+Graph-size, round-trip and build-time regression benchmarks for EEHelper
+
+Each scenario builds EEHelper expressions at realistic scale against the fake ee
+module and records:
+    nodes:       distinct nodes in the serialized expression graphs
+    bytes:       size of the compact serialized graphs
+    round_trips: getInfo() calls, export tasks started and task status requests
+    seconds:     best wall time to build the graphs (and run the client-side loop)
+
+Graph nodes shared by several expressions (e.g. a function mapped over every window)
+are counted once, so per-window inputs are what grows with the grid size.
+
+Measured numbers are compared against tests/benchmark_baseline.json.
+Counts (nodes, bytes, round_trips) may not exceed the baseline.
+Build time depends on the machine (file writes dominate some scenarios), so it
+is only reported (as a test property) unless EEHELPER_BENCH_CHECK_TIME=1 is set.
+It then may not exceed the baseline by more than EEHELPER_BENCH_TIME_TOLERANCE
+(default: 3x, with 0.25 s slack), using the best of three runs.
+
+To rewrite the baseline after an intended change:
+    EEHELPER_UPDATE_BASELINE=1 python -m pytest tests/test_benchmarks.py
+"""
+import os
+import json
+import warnings
+import timeit
+import pytest
+
+import ee
+import fake_ee
+from eehelper import EEHelper
+from eehelper import pack
+from eehelper import runner
+
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+UPDATE_BASELINE = os.environ.get('EEHELPER_UPDATE_BASELINE', '0') == '1'
+CHECK_TIME = os.environ.get('EEHELPER_BENCH_CHECK_TIME', '0') == '1'
+TIME_TOLERANCE = float(os.environ.get('EEHELPER_BENCH_TIME_TOLERANCE', 3.0))
+TIME_SLACK = 0.25
+REPEATS = 3
+
+# 20 year x 12 month window grid, as in extract_GPM_LST_data.py
+YEARS = list(range(2000, 2020))
+JULIAN_DAYS = [('jan', (1, 31)), ('feb', (32, 59)), ('mar', (60, 90)), ('apr', (91, 120)),
+               ('may', (121, 151)), ('jun', (152, 181)), ('jul', (182, 212)), ('aug', (213, 243)),
+               ('sep', (244, 273)), ('oct', (274, 304)), ('nov', (305, 334)), ('dec', (335, 365))]
+
+AOI_COORDS = [[[-150.85512251110526, 67.15679295750088],
+               [-150.85512251110526, 63.089354508791175],
+               [-141.71449751110526, 63.089354508791175],
+               [-141.71449751110526, 67.15679295750088]]]
+
+N_IMAGES = 2000
+
+
+def _landsat_collection():
+    return ee.ImageCollection('LANDSAT/LE07/C01/T1_SR')
+
+
+def _window_collection(year, days):
+    # one collection per window, so every window adds its own filter nodes to the graph
+    return _landsat_collection().filterDate('{}-01-01'.format(year), '{}-01-01'.format(year + 1))\
+        .filter(ee.Filter.calendarRange(days[0], days[1]))
+
+
+def bench_get_images(tmp_dir):
+    helper = EEHelper()
+    aoi = ee.Geometry.Polygon(AOI_COORDS, None, False)
+    colls = list(helper.get_images(_landsat_collection(),
+                                   bounds=aoi,
+                                   year=year,
+                                   start_julian=days[0],
+                                   end_julian=days[1],
+                                   map='ls_sr_band_correction')
+                 for year in YEARS for _, days in JULIAN_DAYS)
+    return colls
+
+
+def bench_add_indices(tmp_dir):
+    helper = EEHelper(scale_factor=10000)
+    return list(_window_collection(year, days).map(EEHelper.ls_sr_band_correction).map(helper.add_indices)
+                for year in YEARS for _, days in JULIAN_DAYS)
+
+
+def bench_ls_sr_band_correction(tmp_dir):
+    return list(_window_collection(year, days).map(EEHelper.ls_sr_band_correction).map(EEHelper.ls_sr_only_clear)
+                for year in YEARS for _, days in JULIAN_DAYS)
+
+
+def bench_composite_image(tmp_dir):
+    helper = EEHelper(scale_factor=10000)
+    composites = []
+    for year in YEARS:
+        for _, days in JULIAN_DAYS:
+            coll = helper.get_images(_landsat_collection(),
+                                     year=year,
+                                     start_julian=days[0],
+                                     end_julian=days[1],
+                                     map='add_indices')
+            helper.composite_index = 'NDVI'
+            helper.composite_function = 'median'
+            composites.append(helper.composite_image(coll))
+            helper.composite_index = None
+            helper.composite_function = 'rms'
+            composites.append(helper.composite_image(coll, band_names=['NDVI']))
+    return composites
+
+
+def bench_export_coll_to_drive(tmp_dir):
+    ee.RECORDER.collection_size = N_IMAGES
+    aoi = ee.Geometry.Polygon(AOI_COORDS, None, False)
+    coll = _landsat_collection().map(EEHelper.ls_sr_band_correction)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        EEHelper.export_coll_to_drive(coll,
+                                      folder='bench',
+                                      scale=30,
+                                      region=aoi,
+                                      metadata_folder=tmp_dir)
+    # every task carries the same graph shape, the first one is representative
+    return list(task.config['image'] for task in ee.RECORDER.tasks[:1])
+
+
+def bench_export_coll_to_drive_packed(tmp_dir):
+    ee.RECORDER.collection_size = N_IMAGES
+    ee.RECORDER.band_names = ['NIR', 'RED']
+    aoi = ee.Geometry.Polygon(AOI_COORDS, None, False)
+    coll = _landsat_collection().map(EEHelper.ls_sr_band_correction)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        EEHelper.export_coll_to_drive(coll,
+                                      folder='bench',
+                                      scale=30,
+                                      region=aoi,
+                                      metadata_folder=tmp_dir,
+                                      packed=True,
+                                      band_names=['NIR', 'RED'])
+    return list(task.config['image'] for task in ee.RECORDER.tasks)
+
+
+def bench_pack_composite_grid(tmp_dir):
+    helper = EEHelper(scale_factor=10000, composite_index=None, composite_function='mean')
+    composites, labels = [], []
+    for year in YEARS:
+        for month, days in JULIAN_DAYS:
+            coll = helper.get_images(_landsat_collection(),
+                                     year=year,
+                                     start_julian=days[0],
+                                     end_julian=days[1],
+                                     map='add_indices')
+            composites.append(helper.composite_image(coll, band_names=['NDVI']))
+            labels.append('y{}_{}'.format(year, month))
+    packed_img, manifest = pack.pack_images(composites, labels, ['NDVI_mean'])
+    EEHelper.export_packed_to_drive(packed_img,
+                                    manifest,
+                                    file_prefix='grid',
+                                    folder='bench',
+                                    scale=30,
+                                    region=ee.Geometry.Polygon(AOI_COORDS, None, False),
+                                    metadata_folder=tmp_dir)
+    return [packed_img]
+
+
+def bench_runner_window_grid(tmp_dir):
+    queue = runner.WorkQueue(os.path.join(tmp_dir, 'queue.db'))
+    queue.put(runner.work_items('gpm',
+                                runner.window_grid(YEARS, JULIAN_DAYS),
+                                {'collection': 'NASA/GPM_L3/IMERG_V06',
+                                 'bands': ['precipitationCal'],
+                                 'composite_function': 'sum',
+                                 'scale_factor': 0.5,
+                                 'folder': 'bench',
+                                 'scale': 1000,
+                                 'crs': 'EPSG:4326',
+                                 'region': AOI_COORDS,
+                                 'metadata_folder': tmp_dir}))
+    runner.run_worker(queue, runner.composite_export_item, worker='bench')
+    os.remove(queue.path)
+    return list(task.config['image'] for task in ee.RECORDER.tasks[-1:])
+
+
+BENCHMARKS = {
+    'get_images': bench_get_images,
+    'add_indices': bench_add_indices,
+    'ls_sr_band_correction': bench_ls_sr_band_correction,
+    'composite_image': bench_composite_image,
+    'export_coll_to_drive': bench_export_coll_to_drive,
+    'export_coll_to_drive_packed': bench_export_coll_to_drive_packed,
+    'pack_composite_grid': bench_pack_composite_grid,
+    'runner_window_grid': bench_runner_window_grid,
+}
+
+
+def measure(name, tmp_dir, repeats=1):
+    """
+    Run one benchmark scenario and return its numbers
+    :param name: Scenario name in BENCHMARKS
+    :param tmp_dir: Scratch folder for files written by the scenario
+    :param repeats: Number of runs, the best build time is reported (default: 1)
+    :returns: dictionary of measured values
+    """
+    seconds = None
+    for _ in range(repeats):
+        recorder = fake_ee.install(fake_ee.Recorder())
+        start = timeit.default_timer()
+        objects = BENCHMARKS[name](tmp_dir)
+        elapsed = timeit.default_timer() - start
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+
+    # graph size is reported for all expressions the scenario builds, with shared nodes counted once
+    stats = fake_ee.graph_stats(objects)
+    return {'nodes': stats['nodes'],
+            'bytes': stats['bytes'],
+            'round_trips': recorder.round_trips,
+            'seconds': round(seconds, 4)}
+
+
+def _load_baseline():
+    if os.path.isfile(BASELINE_FILE):
+        with open(BASELINE_FILE) as baseline_ptr:
+            return json.load(baseline_ptr)
+    return {}
+
+
+def _save_baseline(name, measured):
+    baseline = _load_baseline()
+    baseline[name] = measured
+    with open(BASELINE_FILE, 'w') as baseline_ptr:
+        json.dump(baseline, baseline_ptr, indent=2, sort_keys=True)
+        baseline_ptr.write('\n')
+
+
+@pytest.mark.parametrize('name', sorted(BENCHMARKS))
+def test_benchmark(name, tmp_path, record_property):
+    measured = measure(name, str(tmp_path), REPEATS if UPDATE_BASELINE or CHECK_TIME else 1)
+    record_property('seconds', measured['seconds'])
+
+    if UPDATE_BASELINE:
+        _save_baseline(name, measured)
+        return
+
+    baseline = _load_baseline()
+    assert name in baseline, 'No baseline for {}, run with EEHELPER_UPDATE_BASELINE=1'.format(name)
+    expected = baseline[name]
+
+    for key in ('nodes', 'bytes', 'round_trips'):
+        assert measured[key] <= expected[key], \
+            '{} {} regressed: {} > baseline {}'.format(name, key, measured[key], expected[key])
+
+    if not CHECK_TIME:
+        return
+
+    time_limit = max(expected['seconds'] * TIME_TOLERANCE, expected['seconds'] + TIME_SLACK)
+    assert measured['seconds'] <= time_limit, \
+        '{} build time regressed: {:.4f} s > {:.4f} s'.format(name, measured['seconds'], time_limit)
+
+
+def test_fake_ee_counts_round_trips(recorder):
+    coll = EEHelper().get_images(_landsat_collection(), year=2000)
+    assert recorder.round_trips == 0
+
+    recorder.collection_size = 7
+    assert coll.size().getInfo() == 7
+    assert recorder.getinfo_calls == 1
+
+
+def test_fake_ee_computed_image_info(recorder):
+    asset_info = ee.Image('LANDSAT/SAMPLE').getInfo()
+    assert 'system:footprint' in asset_info['properties']
+
+    computed = _landsat_collection().toBands()
+    assert sorted(computed.getInfo()) == ['bands', 'type']
+    with pytest.raises(RuntimeError):
+        EEHelper.plan_image_export(computed, file_prefix='stack')
+
+
+def test_fake_ee_graph_stats_dedup():
+    img = ee.Image('LANDSAT/SAMPLE')
+    single = fake_ee.graph_stats(img.add(1))
+    shared = fake_ee.graph_stats(img.add(1).addBands(img.add(1)))
+    assert shared['nodes'] == single['nodes'] + 1
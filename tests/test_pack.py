@@ -0,0 +1,131 @@
+import os
+import pytest
+import numpy as np
+
+import ee
+from eehelper import EEHelper, PackManifest
+from eehelper import pack
+
+
+AOI_COORDS = [[[-150.0, 67.0], [-150.0, 63.0], [-142.0, 63.0], [-142.0, 67.0]]]
+
+def test_manifest_band_names_and_subset():
+    manifest = PackManifest(['a', 'b', 'c'], ['NIR', 'RED'])
+    assert len(manifest) == 6
+    assert manifest.band_names[:3] == ['i0000_NIR', 'i0000_RED', 'i0001_NIR']
+
+    subset = manifest.subset(1, 3)
+    assert subset.images == ['b', 'c']
+    assert subset.band_names[0] == 'i0000_NIR'
+
+
+def test_manifest_save_load(tmp_path):
+    manifest = PackManifest(['y2000_jan', 'y2000_feb'], ['precipMM'])
+    filename = str(tmp_path / 'grid_manifest.json')
+    manifest.save(filename)
+
+    loaded = PackManifest.load(filename)
+    assert loaded.images == manifest.images
+    assert loaded.bands == manifest.bands
+
+
+def test_pack_collection_single_request(recorder):
+    recorder.collection_size = 3
+    recorder.band_names = ['NIR', 'RED']
+    packed_img, manifest = pack.pack_collection(ee.ImageCollection('LANDSAT/SAMPLE'))
+
+    assert recorder.getinfo_calls == 1
+    assert manifest.images == ['IMAGE_000000', 'IMAGE_000001', 'IMAGE_000002']
+    assert manifest.bands == ['NIR', 'RED']
+    assert packed_img.func == 'Image.rename'
+    assert packed_img.args['arg0'] == manifest.band_names
+
+
+def test_pack_images_label_mismatch():
+    with pytest.raises(RuntimeError):
+        pack.pack_images([ee.Image(1), ee.Image(2)], ['a'], ['b1'])
+
+
+def test_export_coll_to_drive_packed(recorder, tmp_path):
+    recorder.collection_size = 10
+    EEHelper.export_coll_to_drive(ee.ImageCollection('LANDSAT/SAMPLE'),
+                                  folder='out',
+                                  scale=30,
+                                  region=ee.Geometry.Polygon(AOI_COORDS),
+                                  metadata_folder=str(tmp_path),
+                                  packed=True,
+                                  images_per_task=4)
+
+    assert recorder.tasks_started == 3
+    assert list(task.config['fileNamePrefix'] for task in recorder.tasks) == \
+        ['packed_0000', 'packed_0001', 'packed_0002']
+
+    last = PackManifest.load(os.path.join(str(tmp_path), 'packed_0002_manifest.json'))
+    assert last.images == ['IMAGE_000008', 'IMAGE_000009']
+
+
+def test_packed_export_requires_region(recorder, tmp_path):
+    packed_img, manifest = pack.pack_images([ee.Image(1), ee.Image(2)], ['a', 'b'], ['b1'])
+    with pytest.raises(RuntimeError):
+        EEHelper.export_packed_to_drive(packed_img, manifest, 'grid', metadata_folder=str(tmp_path))
+    with pytest.raises(RuntimeError):
+        EEHelper.export_coll_to_drive(ee.ImageCollection('LANDSAT/SAMPLE'), packed=True)
+    assert recorder.round_trips == 0
+
+
+def test_export_packed_table_to_drive(recorder, tmp_path):
+    packed_img, manifest = pack.pack_images([ee.Image(1), ee.Image(2)], ['a', 'b'], ['b1'])
+    task = EEHelper.export_packed_table_to_drive(packed_img,
+                                                 manifest,
+                                                 ee.FeatureCollection('SITES'),
+                                                 file_prefix='samples',
+                                                 scale=1000,
+                                                 metadata_folder=str(tmp_path))
+
+    assert recorder.round_trips == 1
+    assert task.task_type == 'EXPORT_FEATURES.toDrive'
+
+    # masked pixels are filled before sampling so no sample location is dropped
+    sampled = task.config['collection']
+    assert sampled.func == 'Image.sampleRegions'
+    unmasked = sampled.args['this']
+    assert unmasked.func == 'Image.unmask'
+    assert unmasked.args['arg0'] == -9999
+    assert unmasked.args['arg1'] is False
+    assert unmasked.args['this'].args is packed_img.args
+
+    saved = PackManifest.load(os.path.join(str(tmp_path), 'samples_manifest.json'))
+    assert saved.nodata == -9999
+
+
+def test_unpack_table():
+    manifest = PackManifest(['a', 'b'], ['x', 'y'])
+    rows = [{'site': 1, 'i0000_x': 1.0, 'i0000_y': 2.0, 'i0001_x': 3.0, 'i0001_y': 4.0}]
+    out_rows = manifest.unpack_table(rows)
+    assert out_rows['a'] == [{'site': 1, 'x': 1.0, 'y': 2.0}]
+    assert out_rows['b'] == [{'site': 1, 'x': 3.0, 'y': 4.0}]
+
+
+def test_unpack_table_nodata():
+    manifest = PackManifest(['a', 'b'], ['x'], nodata=-9999)
+    rows = [{'site': '1', 'i0000_x': '0.5', 'i0001_x': '-9999'},
+            {'site': '2', 'i0000_x': '-9999.0', 'i0001_x': ''}]
+    out_rows = manifest.unpack_table(rows)
+    assert out_rows['a'] == [{'site': '1', 'x': '0.5'}, {'site': '2', 'x': None}]
+    assert out_rows['b'] == [{'site': '1', 'x': None}, {'site': '2', 'x': None}]
+
+
+def test_unpack_image():
+    manifest = PackManifest(['a', 'b', 'c'], ['x', 'y'])
+    array = np.arange(6 * 4 * 5).reshape((6, 4, 5))
+
+    images = manifest.unpack_image(array)
+    assert list(images) == ['a', 'b', 'c']
+    assert images['b'].shape == (2, 4, 5)
+    assert (images['c'][1] == array[5]).all()
+
+    bands_last = manifest.unpack_image(np.moveaxis(array, 0, -1), band_axis=-1)
+    assert (bands_last['b'] == images['b']).all()
+
+    with pytest.raises(RuntimeError):
+        manifest.unpack_image(array[:5])
@@ -0,0 +1,212 @@
+import random
+import pytest
+
+import ee
+from eehelper import EEHelper
+from eehelper import plan
+
+
+AOI_COORDS = [[[-150.0, 67.0], [-150.0, 63.0], [-142.0, 63.0], [-142.0, 67.0]]]
+
+# AOI of extract_GPM_LST_data.py, not on the 0.01 degree grid of the fake images
+GPM_AOI_COORDS = [[[-150.85512251110526, 67.15679295750088],
+                   [-150.85512251110526, 63.089354508791175],
+                   [-141.71449751110526, 63.089354508791175],
+                   [-141.71449751110526, 67.15679295750088]]]
+
+
+def _offsets(value, origin, size):
+    offset = (value - origin) / size
+    assert offset == pytest.approx(round(offset), abs=1e-6)
+    return int(round(offset))
+
+
+def _assert_tiles_on_grid(export_plan, transform):
+    col_starts, row_starts = set(), set()
+    for tile in export_plan.tiles:
+        col_start = _offsets(tile.bounds[0], transform[2], transform[0])
+        row_start = _offsets(tile.bounds[3], transform[5], transform[4])
+        assert _offsets(tile.bounds[2], transform[2], transform[0]) == col_start + tile.cols
+        assert _offsets(tile.bounds[1], transform[5], transform[4]) == row_start + tile.rows
+        col_starts.add(col_start)
+        row_starts.add(row_start)
+
+    # tiles share their edges, no pixel is exported twice
+    col_ends = set(_offsets(tile.bounds[2], transform[2], transform[0]) for tile in export_plan.tiles)
+    row_ends = set(_offsets(tile.bounds[1], transform[5], transform[4]) for tile in export_plan.tiles)
+    assert len(col_starts - col_ends) == 1 and len(row_starts - row_ends) == 1
+    assert sum(tile.pixels for tile in export_plan.tiles) == export_plan.pixels
+
+
+def test_band_bytes():
+    assert plan.band_bytes({'type': 'PixelType', 'precision': 'int', 'min': 0, 'max': 255}) == 1
+    assert plan.band_bytes({'type': 'PixelType', 'precision': 'int', 'min': -32768, 'max': 32767}) == 2
+    assert plan.band_bytes({'type': 'PixelType', 'precision': 'int', 'min': 0, 'max': 65535}) == 2
+    assert plan.band_bytes({'type': 'PixelType', 'precision': 'float'}) == 4
+    assert plan.band_bytes({'type': 'PixelType', 'precision': 'double'}) == 8
+
+
+def test_region_coordinates_and_bounds():
+    assert plan.region_coordinates({'type': 'Polygon', 'coordinates': AOI_COORDS}) == AOI_COORDS
+    assert plan.region_coordinates({'type': 'Feature',
+                                    'geometry': {'type': 'Polygon', 'coordinates': AOI_COORDS}}) == AOI_COORDS
+    assert plan.region_coordinates({'type': 'Unknown'}) is None
+    assert plan.coordinates_bounds(AOI_COORDS) == (-150.0, 63.0, -142.0, 67.0)
+    assert plan.coordinates_bounds([[AOI_COORDS[0]], [[[0.0, 0.0], [1.0, 1.0]]]]) == (-150.0, 0.0, 1.0, 67.0)
+    assert plan.coordinates_bounds([-150.0, 65.0]) == (-150.0, 65.0, -150.0, 65.0)
+    assert plan.coordinates_bounds([[-150.0, 65.0], [-142.0, 63.0]]) == (-150.0, 63.0, -142.0, 65.0)
+
+
+def test_plan_native_grid_without_tasks(recorder):
+    export_plan = EEHelper.plan_image_export(ee.Image('SAMPLE'),
+                                             region=ee.Geometry.Polygon(AOI_COORDS),
+                                             file_prefix='sample')
+    assert recorder.getinfo_calls == 2
+    assert recorder.tasks_started == 0
+    assert (export_plan.cols, export_plan.rows) == (800, 400)
+    assert export_plan.bytes == 800 * 400 * 2
+    assert len(export_plan.tiles) == 1
+    assert export_plan.tiles[0].file_prefix == 'sample'
+    assert export_plan.crs_transform == recorder.crs_transform
+    assert export_plan.scale is None
+
+
+def test_plan_without_footprint_requires_region(recorder):
+    img_prop = {'type': 'Image',
+                'bands': [{'id': 'i0000_b1', 'crs': 'EPSG:4326', 'crs_transform': recorder.crs_transform,
+                           'data_type': {'type': 'PixelType', 'precision': 'float'}}]}
+    with pytest.raises(RuntimeError):
+        plan.plan_export(ee.Image('SAMPLE'), img_prop, 'composite')
+
+    export_plan = plan.plan_export(ee.Image('SAMPLE'), img_prop, 'composite', region=AOI_COORDS)
+    assert (export_plan.cols, export_plan.rows) == (800, 400)
+
+
+def test_plan_splits_into_tiles(recorder):
+    recorder.band_names = ['b1', 'b2', 'b3']
+    export_plan = EEHelper.plan_image_export(ee.Image('SAMPLE'),
+                                             scale=30,
+                                             region=ee.Geometry.Polygon(AOI_COORDS),
+                                             file_prefix='sample',
+                                             max_pixels=1e8)
+    assert export_plan.pixels > 1e8
+    assert len(export_plan.tiles) >= export_plan.pixels / 1e8
+    assert all(tile.pixels <= 1e8 for tile in export_plan.tiles)
+    assert sum(tile.pixels for tile in export_plan.tiles) == export_plan.pixels
+
+    # scale grid has its origin at 0, 0
+    size = 30 / plan.METERS_PER_DEGREE
+    _assert_tiles_on_grid(export_plan, [size, 0, 0, 0, -size, 0])
+    xmin = min(tile.bounds[0] for tile in export_plan.tiles)
+    ymax = max(tile.bounds[3] for tile in export_plan.tiles)
+    assert xmin <= -150.0 < xmin + size
+    assert ymax - size < 67.0 <= ymax
+
+
+def test_plan_native_tiles_on_pixel_grid(recorder, tmp_path):
+    export_plan = EEHelper.export_image_to_drive(ee.Image('SAMPLE'),
+                                                 folder='out',
+                                                 region=ee.Geometry.Polygon(GPM_AOI_COORDS),
+                                                 metadata_folder=str(tmp_path),
+                                                 file_prefix='gpm',
+                                                 max_pixels=1e5)
+    assert len(export_plan.tiles) > 1
+    _assert_tiles_on_grid(export_plan, recorder.crs_transform)
+    assert (export_plan.cols, export_plan.rows) == (915, 408)
+
+    for tile in export_plan.tiles:
+        config = tile.task.config
+        assert config['crsTransform'] == tile.crs_transform
+        assert config['crsTransform'][2:6:3] == [tile.bounds[0], tile.bounds[3]]
+        assert config['dimensions'] == '{}x{}'.format(tile.cols, tile.rows)
+        assert 'scale' not in config and 'region' not in config
+
+
+def test_plan_projected_native_grid(recorder):
+    # the fake does not reproject, region coordinates are given in the crs units
+    recorder.crs = 'EPSG:32606'
+    recorder.crs_transform = [30.0, 0.0, 399975.0, 0.0, -30.0, 7450015.0]
+    region = ee.Geometry.Polygon([[[400100.0, 7449000.0], [400100.0, 7300000.0],
+                                   [520000.0, 7300000.0], [520000.0, 7449000.0]]])
+    export_plan = EEHelper.plan_image_export(ee.Image('SAMPLE'),
+                                             region=region,
+                                             file_prefix='utm',
+                                             max_pixels=1e6)
+    assert recorder.getinfo_calls == 3
+    assert export_plan.bounds[0] == 400095.0
+    assert len(export_plan.tiles) > 1
+    _assert_tiles_on_grid(export_plan, recorder.crs_transform)
+
+
+def test_plan_coarsen_picks_pyramid_level(recorder):
+    export_plan = EEHelper.plan_image_export(ee.Image('SAMPLE'),
+                                             scale=30,
+                                             region=ee.Geometry.Polygon(AOI_COORDS),
+                                             file_prefix='sample',
+                                             max_pixels=1e7,
+                                             strategy='coarsen')
+    assert export_plan.level > 0
+    assert export_plan.pixels <= 1e7
+    assert export_plan.scale == 30 * 2 ** export_plan.level
+    assert export_plan.crs_transform is None
+    assert len(export_plan.tiles) == 1
+
+
+def test_plan_coarsen_native_grid(recorder):
+    export_plan = EEHelper.plan_image_export(ee.Image('SAMPLE'),
+                                             region=ee.Geometry.Polygon(AOI_COORDS),
+                                             file_prefix='sample',
+                                             max_pixels=1e5,
+                                             strategy='coarsen')
+    assert export_plan.level == 1
+    assert export_plan.scale is None
+    assert export_plan.crs_transform[0] == recorder.crs_transform[0] * 2
+    assert export_plan.crs_transform[4] == recorder.crs_transform[4] * 2
+    assert export_plan.crs_transform[2::3] == recorder.crs_transform[2::3]
+
+
+def test_plan_crs_override_uses_scale(recorder):
+    export_plan = EEHelper.plan_image_export(ee.Image('SAMPLE'),
+                                             crs='EPSG:3338',
+                                             region=ee.Geometry.Polygon(AOI_COORDS),
+                                             file_prefix='sample')
+    assert export_plan.crs_transform is None
+    assert export_plan.scale == pytest.approx(recorder.crs_transform[0] * plan.METERS_PER_DEGREE)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_split_tiles_within_limit(seed):
+    rand = random.Random(seed)
+    for _ in range(200):
+        rows, cols = rand.randint(1, 5000), rand.randint(1, 5000)
+        max_pixels = rand.randint(1, rows * cols)
+        export_plan = plan.ExportPlan(None, 'sample', None, 'EPSG:4326', None, 30, None,
+                                      (0.0, 0.0, float(cols), float(rows)), rows, cols, 1)
+        export_plan.split(max_pixels)
+        assert all(tile.pixels <= max_pixels for tile in export_plan.tiles)
+        assert sum(tile.pixels for tile in export_plan.tiles) == rows * cols
+
+
+def test_split_reported_shape():
+    export_plan = plan.ExportPlan(None, 'sample', None, 'EPSG:4326', None, 30, None,
+                                  (0.0, 0.0, 3404.0, 2528.0), 2528, 3404, 2)
+    export_plan.split(max_pixels=1e10, max_bytes=5101 * 2)
+    assert max(tile.pixels for tile in export_plan.tiles) <= 5101
+
+
+def test_execute_starts_all_tiles(recorder, tmp_path):
+    export_plan = EEHelper.export_image_to_drive(ee.Image('SAMPLE'),
+                                                 folder='out',
+                                                 scale=30,
+                                                 region=ee.Geometry.Polygon(AOI_COORDS),
+                                                 metadata_folder=str(tmp_path),
+                                                 file_prefix='sample',
+                                                 max_pixels=1e7)
+    assert len(export_plan.tiles) > 1
+    assert recorder.tasks_started == len(export_plan.tiles)
+    assert sorted(task.config['fileNamePrefix'] for task in export_plan.tasks) == \
+        sorted(tile.file_prefix for tile in export_plan.tiles)
+    assert all(task.config['maxPixels'] == plan.MAX_TOTAL_PIXELS for task in export_plan.tasks)
+    assert all('crsTransform' not in task.config for task in export_plan.tasks)
+    assert all(task.config['scale'] == 30 for task in export_plan.tasks)
+    assert (tmp_path / 'sample.txt').exists()
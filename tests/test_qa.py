@@ -0,0 +1,70 @@
+import pytest
+import numpy as np
+
+import ee
+import fake_ee
+from eehelper import EEHelper, QALayout
+from eehelper import qa
+
+
+def _functions(obj):
+    graph = fake_ee.serialize(obj)
+    return sorted(node['functionInvocationValue']['functionName'] for node in graph['values'].values()
+                  if 'functionInvocationValue' in node)
+
+
+def test_mask_compiles_to_single_bitwise_test():
+    mask = qa.LANDSAT_PIXEL_QA.mask(cloud=0, cloud_shadow=0, snow=0)
+    test = mask.ee_test(ee.Image('QA'))
+    assert _functions(test) == ['Image.bitwiseAnd', 'Image.eq', 'Image.load']
+    assert test.args['this'].args['arg0'] == (1 << 3) | (1 << 4) | (1 << 5)
+    assert test.args['arg0'] == 0
+
+
+def test_mask_with_value_sets_uses_one_remap():
+    mask = qa.LANDSAT_PIXEL_QA.mask(cloud=0, cloud_confidence=[0, 1])
+    test = mask.ee_test(ee.Image('QA'))
+    assert _functions(test) == ['Image.bitwiseAnd', 'Image.load', 'Image.remap']
+    assert mask.patterns == [0, 1 << 6]
+
+
+def test_full_band_test_is_equality():
+    test = qa.LANDSAT_NOT_SATURATED.ee_test(ee.Image('QA'))
+    assert _functions(test) == ['Image.eq', 'Image.load']
+
+
+def test_ls_sr_only_clear_applies_one_update_mask():
+    out_img = EEHelper.ls_sr_only_clear(ee.Image('LANDSAT/SAMPLE'))
+    functions = _functions(out_img)
+    assert functions.count('Image.updateMask') == 1
+    assert functions.count('Image.bitwiseAnd') == 1
+
+
+def test_invalid_flag_and_value():
+    with pytest.raises(RuntimeError):
+        qa.LANDSAT_PIXEL_QA.mask(fog=0)
+    with pytest.raises(RuntimeError):
+        qa.LANDSAT_PIXEL_QA.mask(cloud_confidence=4)
+
+
+def test_lookup_table_matches_bitwise_test():
+    mask = QALayout('QC', {'a': (0, 2), 'b': (3, 1)}, bits=8).mask(a=[0, 1], b=0)
+    lut = mask.lookup_table()
+    assert lut.shape == (65536,)
+
+    codes = np.arange(65536)
+    expected = (((codes & 3) <= 1) & ((codes & 8) == 0) & (codes < 256))
+    assert (lut == expected).all()
+
+
+def test_apply_on_stack():
+    stack = np.array([[[2, 34], [322, 66]],
+                      [[0, 1], [2, 2]]], dtype=np.int16)
+    clear = qa.LANDSAT_CLEAR.apply(stack)
+    assert clear.shape == stack.shape
+    assert clear.tolist() == [[[True, True], [True, True]],
+                              [[False, False], [True, True]]]
+
+    combined = qa.combined_mask({'PIXEL_QA': stack[0], 'RADSAT_QA': stack[1]},
+                                [qa.LANDSAT_CLEAR, qa.LANDSAT_NOT_SATURATED])
+    assert combined.tolist() == [[True, False], [False, False]]
@@ -0,0 +1,180 @@
+import os
+import multiprocessing
+import pytest
+
+from eehelper import runner
+from eehelper.runner import WorkQueue
+
+
+AOI_COORDS = [[[-150.0, 67.0], [-150.0, 63.0], [-142.0, 63.0], [-142.0, 67.0]]]
+
+
+def _square(payload):
+    return payload['year'] * payload['start_julian']
+
+
+def _queue(tmp_path, **kwargs):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), **kwargs)
+    queue.put(runner.work_items('test', runner.window_grid([2000, 2001], runner.MONTHS[:3]), {'scale': 30}))
+    return queue
+
+
+def test_window_grid_and_work_items():
+    windows = runner.window_grid(range(2000, 2020))
+    assert len(windows) == 240
+    assert windows[13] == {'year': 2001, 'label': 'feb', 'start_julian': 32, 'end_julian': 59}
+
+    items = runner.work_items('gpm', windows[:2], {'collection': 'NASA/GPM_L3/IMERG_V06'})
+    assert items[1][0] == 'gpm_y2000_feb'
+    assert items[1][1]['file_prefix'] == 'gpm_y2000_feb'
+    assert items[1][1]['collection'] == 'NASA/GPM_L3/IMERG_V06'
+
+
+def test_put_skips_existing_items(tmp_path):
+    queue = _queue(tmp_path)
+    assert queue.counts() == {'pending': 6}
+    assert queue.put(runner.work_items('test', runner.window_grid([2001, 2002], runner.MONTHS[:3]), {})) == 3
+    assert queue.counts() == {'pending': 9}
+
+
+def test_claim_complete(tmp_path):
+    queue = _queue(tmp_path)
+    item = queue.claim('w1')
+    assert item.attempts == 1
+    assert queue.claim('w2').item_id != item.item_id
+
+    assert queue.heartbeat(item)
+    assert queue.complete(item, {'value': 1})
+    assert queue.results() == {item.item_id: {'value': 1}}
+    assert queue.counts() == {'pending': 4, 'running': 1, 'done': 1}
+
+
+def test_expired_lease_is_reclaimed(tmp_path):
+    queue = _queue(tmp_path)
+    lost = list(queue.claim('w1', lease_seconds=-1) for _ in range(6))
+    reclaimed = queue.claim('w2')
+    assert reclaimed.item_id in set(item.item_id for item in lost)
+    assert reclaimed.attempts == 2
+
+    # the lost worker no longer owns the item
+    lost_item = [item for item in lost if item.item_id == reclaimed.item_id][0]
+    assert not queue.heartbeat(lost_item)
+    assert not queue.complete(lost_item, 'stale')
+
+
+def test_fail_retries_until_max_attempts(tmp_path):
+    queue = _queue(tmp_path, max_attempts=2)
+    item = queue.claim('w1')
+    assert queue.fail(item, 'error 1') == 'pending'
+
+    retried = None
+    while retried is None or retried.item_id != item.item_id:
+        retried = queue.claim('w1')
+    assert retried.attempts == 2
+    assert queue.fail(retried, 'error 2') == 'failed'
+    assert queue.results('failed') == {item.item_id: 'error 2'}
+
+    assert queue.reset_failed() == 1
+
+
+def test_run_worker(tmp_path):
+    queue = _queue(tmp_path)
+    assert runner.run_worker(queue, _square, worker='w1') == 6
+    assert queue.counts() == {'done': 6}
+    assert queue.results()['test_y2001_feb'] == 2001 * 32
+
+
+def test_run_worker_records_failures(tmp_path):
+    queue = _queue(tmp_path, max_attempts=1)
+    runner.run_worker(queue, lambda payload: 1 // 0, worker='w1')
+    assert queue.counts() == {'failed': 6}
+    assert 'ZeroDivisionError' in queue.results('failed')['test_y2000_jan']
+
+
+def test_max_attempts_stored_in_queue(tmp_path):
+    queue = _queue(tmp_path, max_attempts=1)
+    assert WorkQueue(queue.path).max_attempts == 1
+    with pytest.warns(UserWarning):
+        assert WorkQueue(queue.path, max_attempts=5).max_attempts == 1
+
+    # a worker opening the queue by path fails items after one attempt
+    runner.run_worker(queue.path, lambda payload: 1 // 0, worker='w1', max_items=1)
+    assert queue.counts() == {'pending': 5, 'failed': 1}
+    assert WorkQueue(str(tmp_path / 'new.db')).max_attempts == WorkQueue.DEFAULT_MAX_ATTEMPTS
+
+
+def test_run_worker_init_func(tmp_path):
+    queue = _queue(tmp_path)
+    calls = []
+    runner.run_worker(queue, _square, worker='w1', init_func=lambda: calls.append(1))
+    assert calls == [1]
+    assert queue.counts() == {'done': 6}
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='requires fork')
+def test_run_workers_processes(tmp_path):
+    queue = _queue(tmp_path)
+    queue.put(runner.work_items('more', runner.window_grid(range(2000, 2010)), {}))
+    counts = runner.run_workers(queue.path, _square, processes=3, context=multiprocessing.get_context('fork'))
+    assert counts == {'done': 126}
+    assert len(queue.results()) == 126
+
+
+def _gpm_queue(tmp_path, **kwargs):
+    queue = WorkQueue(str(tmp_path / 'queue.db'), **kwargs)
+    queue.put(runner.work_items('gpm',
+                                runner.window_grid([2000], runner.MONTHS[:2]),
+                                {'collection': 'NASA/GPM_L3/IMERG_V06',
+                                 'bands': ['precipitationCal'],
+                                 'composite_function': 'sum',
+                                 'scale_factor': 0.5,
+                                 'folder': 'out',
+                                 'scale': 1000,
+                                 'crs': 'EPSG:4326',
+                                 'region': AOI_COORDS,
+                                 'metadata_folder': str(tmp_path),
+                                 'poll_seconds': 0}))
+    return queue
+
+
+def test_composite_export_item(recorder, tmp_path):
+    queue = _gpm_queue(tmp_path)
+    runner.run_worker(queue, runner.composite_export_item, worker='w1', init_func=runner.ee_initializer())
+    results = queue.results()
+    assert results['gpm_y2000_feb']['images'] == recorder.collection_size
+    assert results['gpm_y2000_feb']['tasks'] == [{'id': recorder.tasks[1].id,
+                                                  'description': 'Export_gpm_y2000_feb',
+                                                  'state': 'COMPLETED'}]
+    assert recorder.tasks_started == 2
+    assert recorder.status_calls == 2
+    assert os.path.isfile(str(tmp_path / 'gpm_y2000_jan.txt'))
+
+
+def test_composite_export_item_retries_failed_exports(recorder, tmp_path):
+    recorder.task_state = 'FAILED'
+    queue = _gpm_queue(tmp_path, max_attempts=2)
+    runner.run_worker(queue, runner.composite_export_item, worker='w1')
+    assert queue.counts() == {'failed': 2}
+    assert recorder.tasks_started == 4
+    assert 'Export failed on the fake server' in queue.results('failed')['gpm_y2000_jan']
+
+
+def test_wait_for_tasks_polls_until_final(recorder):
+    class Task(object):
+        def __init__(self, states):
+            self.states = list(states)
+
+        def status(self):
+            return {'state': self.states.pop(0)}
+
+    statuses = runner.wait_for_tasks([Task(['READY', 'RUNNING', 'COMPLETED']), Task(['CANCELLED'])],
+                                     poll_seconds=0)
+    assert statuses == [{'state': 'COMPLETED'}, {'state': 'CANCELLED'}]
+
+
+def test_composite_export_item_requires_region(recorder):
+    payload = runner.work_items('gpm', runner.window_grid([2000], runner.MONTHS[:1]),
+                                {'collection': 'NASA/GPM_L3/IMERG_V06'})[0][1]
+    with pytest.raises(RuntimeError):
+        runner.composite_export_item(payload)
+    assert recorder.round_trips == 0